@@ -0,0 +1,135 @@
+from atomic import atomic_path, atomic_write
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from PIL import Image
+import cv2
+import json
+import numpy as np
+
+ARCHIVE_DIR = 'images/archive/'
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+#Pillow holds every frame of a webp or gif animation in memory until the file is written, so those
+#are limited to this many bytes of RGB frames. mp4 frames are streamed to the file one at a time
+MAX_BUFFERED_BYTES = 1024 ** 3
+
+class MosaicArchive:
+    #rolling archive of the mosaic (and optionally the per satellite layers) of every cycle.
+    #Each frame is stored as its own compressed image, so adding, evicting and reading a
+    #frame never touches the others. Frames older than max_age or beyond max_frames are evicted
+    def __init__(self, directory=ARCHIVE_DIR, max_age=timedelta(days=2), max_frames=None, quality=90) -> None:
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.max_frames = max_frames
+        self.quality = quality
+        self.index_file = self.directory / 'index.json'
+
+    def _load_index(self):
+        try:
+            with open(self.index_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        atomic_write(self.index_file, lambda file: json.dump(index, file, indent=1), 'w')
+
+    def add(self, image, timestamp=None, layer='mosaic'):
+        #store an RGB(A) array, the alpha channel is dropped like in the final mosaic
+        timestamp = timestamp or datetime.now(timezone.utc)
+        name = f'{layer}/{timestamp.strftime(TIMESTAMP_FORMAT)}.webp'
+        path = self.directory / name
+        frame = Image.fromarray(np.ascontiguousarray(image[:, :, :3]))
+        atomic_write(path, lambda file: frame.save(file, 'WEBP', quality=self.quality, method=4))
+
+        index = self._load_index()
+        index.setdefault(layer, {})[timestamp.strftime(TIMESTAMP_FORMAT)] = name
+        self._save_index(self.evict(index))
+        return path
+
+    def evict(self, index=None):
+        #drop frames that are too old, then the oldest ones if there are too many
+        save = index is None
+        index = self._load_index() if index is None else index
+        now = datetime.now(timezone.utc)
+
+        for layer, frames in index.items():
+            timestamps = sorted(frames)
+            remove = [stamp for stamp in timestamps if self.max_age is not None and now - _parse(stamp) > self.max_age]
+            keep = [stamp for stamp in timestamps if stamp not in remove]
+
+            if (self.max_frames is not None and len(keep) > self.max_frames):
+                remove += keep[:len(keep) - self.max_frames]
+
+            for stamp in remove:
+                (self.directory / frames.pop(stamp)).unlink(missing_ok=True)
+
+        if (save):
+            self._save_index(index)
+
+        return index
+
+    def frames(self, layer='mosaic', start=None, end=None):
+        #(timestamp, path) of the frames of a layer in time order, optionally within [start, end]
+        frames = self._load_index().get(layer, {})
+
+        for stamp in sorted(frames):
+            timestamp = _parse(stamp)
+
+            if ((start is None or timestamp >= start) and (end is None or timestamp <= end)):
+                yield timestamp, self.directory / frames[stamp]
+
+def _parse(stamp):
+    return datetime.strptime(stamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+def _read_frames(archive, layer, size, start, end):
+    #frames are decoded and resized one at a time, as the writer asks for them
+    for timestamp, path in archive.frames(layer, start, end):
+        with Image.open(path) as frame:
+            yield frame.convert('RGB').resize((size[1], size[0]), Image.LANCZOS) if size else frame.convert('RGB')
+
+def build_animation(archive, out_file, layer='mosaic', size=(512, 1024), fps=8, start=None, end=None):
+    #build a looped animation (mp4, webp or gif, from the file extension) of the archived frames.
+    #size is (height, width), None keeps the archived resolution
+    out_file = Path(out_file)
+    frames = _read_frames(archive, layer, size, start, end)
+    first = next(frames, None)
+
+    if (first is None):
+        raise ValueError(f'No archived {layer} frames to animate.')
+
+    count = 1
+
+    #the writers pick the format from the extension, so it stays last in the temporary name
+    with atomic_path(out_file, keep_suffix=True) as tmp_file:
+        if (out_file.suffix == '.mp4'):
+            writer = cv2.VideoWriter(str(tmp_file), cv2.VideoWriter_fourcc(*'mp4v'), fps, first.size)
+
+            try:
+                writer.write(cv2.cvtColor(np.asarray(first), cv2.COLOR_RGB2BGR))
+
+                for frame in frames:
+                    writer.write(cv2.cvtColor(np.asarray(frame), cv2.COLOR_RGB2BGR))
+                    count += 1
+            finally:
+                writer.release()
+        elif (out_file.suffix in ('.webp', '.gif')):
+            total = sum(1 for _ in archive.frames(layer, start, end))
+            needed = total * first.size[0] * first.size[1] * 3
+
+            if (needed > MAX_BUFFERED_BYTES):
+                raise ValueError(f'{total} frames of {first.size[0]}x{first.size[1]} need {needed / 1e9:.1f} GB of memory as {out_file.suffix}, '
+                                 f'use .mp4, a smaller size or a shorter time range.')
+
+            def counted(frames):
+                nonlocal count
+
+                for frame in frames:
+                    count += 1
+                    yield frame
+
+            first.save(tmp_file, save_all=True, append_images=counted(frames), duration=int(1000 / fps), loop=0)
+        else:
+            raise ValueError(f'Unsupported animation format {out_file.suffix}, use .mp4, .webp or .gif.')
+
+    print(f'Wrote {count} frame animation to {out_file}.')
+    return out_file
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from pathlib import Path
+import os
+
+#suffix of files that are still being written. They are renamed once complete, so readers (the web
+#server, memory maps, other processes, the satpy readers) never see a partial file
+PART_SUFFIX = '.part'
+
+def partial_path(path, keep_suffix=False):
+    #temporary name of a file while it is written. keep_suffix keeps the extension last, for
+    #writers that pick the format from it
+    path = Path(path)
+
+    if (keep_suffix):
+        return path.with_name(path.stem + PART_SUFFIX + path.suffix)
+
+    return path.with_name(path.name + PART_SUFFIX)
+
+@contextmanager
+def atomic_path(path, keep_suffix=False, keep_partial=False):
+    #the temporary path to write to, renamed to path when the block completes. On error the
+    #temporary file is removed, unless keep_partial is set (downloads are resumed from it)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = partial_path(path, keep_suffix)
+
+    try:
+        yield tmp_path
+    except BaseException:
+        if (not keep_partial):
+            tmp_path.unlink(missing_ok=True)
+
+        raise
+
+    os.replace(tmp_path, path)
+
+def atomic_write(path, write, mode='wb'):
+    #write a file through write(file), e.g. atomic_write(path, lambda file: np.save(file, array))
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode) as file:
+            write(file)
+
+    return Path(path)
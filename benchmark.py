@@ -0,0 +1,252 @@
+#offline benchmarks of the image pipeline on synthetic inputs, no NOAA buckets or EUMETSAT
+#credentials needed. Run from the repository root:
+#   python benchmark.py                    run every benchmark and print the results
+#   python benchmark.py --save-baseline    also store the results as the new baseline
+#   python benchmark.py --compare          compare with the baseline, exit with 1 on regressions
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent
+BASELINE_FILE = REPO_DIR / 'benchmark_baseline.json'
+SATELLITES = ['goes_east', 'goes_west', 'himawari', 'meteosat_9', 'meteosat_10']
+#worldeqc3km73
+SHAPE = (2048, 4096)
+#throughput is reported in uncompressed RGBA bytes per second, whatever the stage writes
+FRAME_BYTES = SHAPE[0] * SHAPE[1] * 4
+
+def synthetic_image(seed, shape=SHAPE, channels=4):
+    #smooth noise, so the images compress like cloud imagery rather than like random bytes
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (shape[0] // 32, shape[1] // 32, channels), dtype=np.uint8)
+    return cv2.resize(small, (shape[1], shape[0]), interpolation=cv2.INTER_CUBIC)
+
+def setup(workdir):
+    #lay out the same directories the pipeline uses, with synthetic projected layers and masks
+    from helpers import generate_background
+    from masks import get_alpha_mask
+
+    for directory in ['images/projected/blended_overlays', 'images/projected/tmp', 'images/fd'] + [f'data/{satellite}' for satellite in SATELLITES]:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+    generate_background()
+
+    for seed, satellite in enumerate(SATELLITES):
+        mask = np.asarray(get_alpha_mask(satellite))
+        layer = synthetic_image(seed)
+        layer[:, :, 3] = mask
+        base = f'images/projected/{satellite}_projected'
+        cv2.imwrite(base + '.png', layer)
+        cv2.imwrite(base + '_vis.png', layer)
+        cv2.imwrite(base + '_ir.png', synthetic_image(seed + 100))
+        cv2.imwrite(base + '.jpg', layer[:, :, :3], [int(cv2.IMWRITE_JPEG_QUALITY), 100])
+
+def _satellite():
+    #processing steps only need the satellite name and paths, so no network client is used
+    from satellites import Himawari
+    return Himawari('himawari', ['true_color_day', 'night_ir_alpha'], True)
+
+def bench_create_alpha_masks():
+    from helpers import create_alpha_masks
+    return create_alpha_masks('goes_east').nbytes
+
+def bench_apply_blending_masks():
+    satellite = _satellite()
+    satellite._apply_blending_masks()
+    return FRAME_BYTES
+
+def bench_combine_images():
+    from satellites import Satellite
+    base = 'images/projected/himawari_projected'
+    Satellite._combine_images(base + '_ir.png', base + '_vis.png', 'images/projected/tmp/combined.png')
+    return 2 * FRAME_BYTES
+
+def bench_to_jpg():
+    import shutil
+    satellite = _satellite()
+    base = 'images/projected/tmp/to_jpg'
+    shutil.copy('images/projected/himawari_projected_vis.png', base + '.png')
+    satellite._to_jpg(base)
+    return FRAME_BYTES
+
+def bench_stitch_images():
+    from helpers import stitch_images
+    stitch_images()
+    return len(SATELLITES) * FRAME_BYTES
+
+def bench_stitch_layers():
+    #in memory mode, only the final mosaic is encoded
+    from helpers import stitch_images
+    from masks import get_alpha_mask
+    layers = {}
+
+    for seed, satellite in enumerate(SATELLITES):
+        layers[satellite] = synthetic_image(seed)
+        layers[satellite][:, :, 3] = get_alpha_mask(satellite)
+
+    start = time.perf_counter()
+    stitch_images(layers)
+    return len(SATELLITES) * FRAME_BYTES, time.perf_counter() - start
+
+def bench_s3_download(endpoint_url=None, files=20, file_mb=4):
+    #download synthetic full disk files through the same S3Downloader the satellites use, from
+    #either a local S3 server (MinIO, moto server) or moto's in process mock
+    import boto3
+    from downloads import S3Downloader
+
+    def run(client):
+        bucket = 'earth-now-benchmark'
+        client.create_bucket(Bucket=bucket)
+        body = os.urandom(file_mb * 1024 * 1024)
+
+        for i in range(files):
+            client.put_object(Bucket=bucket, Key=f'bench/file_{i:03d}', Body=body)
+
+        downloader = S3Downloader(client, bucket)
+        start = time.perf_counter()
+        stats = downloader.download_many([(f'bench/file_{i:03d}', f'data/himawari/file_{i:03d}') for i in range(files)])
+        return sum(stat['bytes'] for stat in stats), time.perf_counter() - start
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    if (endpoint_url is not None):
+        return run(boto3.client('s3', endpoint_url=endpoint_url))
+
+    from moto import mock_aws
+
+    with mock_aws():
+        return run(boto3.client('s3'))
+
+BENCHMARKS = {
+    'create_alpha_masks': bench_create_alpha_masks,
+    '_apply_blending_masks': bench_apply_blending_masks,
+    '_combine_images': bench_combine_images,
+    '_to_jpg': bench_to_jpg,
+    'stitch_images': bench_stitch_images,
+    'stitch_images_in_memory': bench_stitch_layers,
+    's3_download': bench_s3_download,
+}
+
+def _run(name, kwargs, queue):
+    from profiling import peak_rss_mb
+    start_rss = peak_rss_mb()
+
+    try:
+        start = time.perf_counter()
+        result = BENCHMARKS[name](**kwargs)
+        seconds = time.perf_counter() - start
+
+        #benchmarks with setup of their own return the time of the measured part
+        if (isinstance(result, tuple)):
+            result, seconds = result
+
+        queue.put({'seconds': seconds, 'bytes': result, 'peak_rss_mb': peak_rss_mb(), 'rss_growth_mb': round(peak_rss_mb() - start_rss, 1)})
+    except Exception as error:
+        queue.put({'error': repr(error)})
+
+def run_benchmark(name, repeat=3, **kwargs):
+    #every repetition runs in a fresh forked process, so the peak memory of one benchmark
+    #does not hide the next one. The fastest repetition is reported
+    context = multiprocessing.get_context('fork')
+    runs = []
+
+    for i in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_run, args=(name, kwargs, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+
+        if ('error' in result):
+            return result
+
+        runs.append(result)
+
+    best = min(runs, key=lambda run: run['seconds'])
+    best['throughput_mb_s'] = round(best['bytes'] / 1e6 / max(best['seconds'], 1e-9), 2)
+    best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+    best['seconds'] = round(best['seconds'], 4)
+    return best
+
+def compare(results, baseline, tolerance):
+    #a benchmark regresses if it got slower, or its peak memory grew, by more than the tolerance
+    regressions = []
+
+    for name, result in results.items():
+        if (name not in baseline or 'error' in result or 'error' in baseline[name]):
+            continue
+
+        time_ratio = result['seconds'] / max(baseline[name]['seconds'], 1e-9)
+        rss_ratio = result['peak_rss_mb'] / max(baseline[name]['peak_rss_mb'], 1e-9)
+        flag = ''
+
+        if (time_ratio > 1. + tolerance or rss_ratio > 1. + tolerance):
+            regressions.append(name)
+            flag = '  REGRESSION'
+
+        print(f'{name:<26} time x{time_ratio:.2f}  peak rss x{rss_ratio:.2f}{flag}')
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the earth-now image pipeline.')
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS), help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--endpoint-url', help='local S3 server for the download benchmark, moto is used otherwise')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging a regression')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix='earth-now-bench-') as workdir:
+        #the pipeline uses paths relative to the working directory
+        os.chdir(workdir)
+
+        try:
+            setup(workdir)
+
+            for name in args.benchmarks:
+                kwargs = {'endpoint_url': args.endpoint_url} if name == 's3_download' else {}
+                results[name] = run_benchmark(name, args.repeat, **kwargs)
+                result = results[name]
+
+                if ('error' in result):
+                    print(f'{name:<26} failed: {result["error"]}')
+                else:
+                    print(f'{name:<26} {result["seconds"]:8.3f} s  {result["throughput_mb_s"]:9.1f} MB/s  '
+                          f'peak rss {result["peak_rss_mb"]:8.1f} MB')
+        finally:
+            os.chdir(cwd)
+
+    if (args.output):
+        Path(args.output).write_text(json.dumps(results, indent=1))
+
+    if (args.save_baseline):
+        BASELINE_FILE.write_text(json.dumps(results, indent=1))
+
+    if (args.compare):
+        if (not BASELINE_FILE.exists()):
+            print(f'No baseline at {BASELINE_FILE}, run with --save-baseline first.')
+            return 1
+
+        regressions = compare(results, json.loads(BASELINE_FILE.read_text()), args.tolerance)
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
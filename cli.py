@@ -0,0 +1,160 @@
+#command line entry point:
+#   earth-now run|download|process|stitch|masks|imports [--satellites goes_east himawari ...]
+#Each command imports only the modules it needs inside its own function, and nothing is created
+#at import time, so single stage commands start without loading satpy or contacting any server
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+SATELLITES = ['goes_east', 'goes_west', 'himawari', 'meteosat_9', 'meteosat_10']
+#modules whose import cost is reported by the imports command
+MODULES = ['cli', 'scheduler', 'daemon', 'satellites', 'helpers', 'masks', 'mosaic', 'downloads', 'tiles', 'archive', 'encoding']
+
+def run(args):
+    from scheduler import create_satellites, run_once
+
+    satellites = create_satellites(args.satellites)
+
+    if (args.daemon):
+        from daemon import Daemon
+        Daemon(satellites, poll_interval=args.poll_interval).run(args.max_cycles)
+    else:
+        run_once(satellites, incremental=not args.full)
+
+def download(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from scheduler import create_satellites, download
+
+    satellites = create_satellites(args.satellites)
+
+    #a failed satellite does not stop the others
+    def attempt(satellite):
+        try:
+            download(satellite)
+        except Exception as error:
+            print(error)
+
+    with ThreadPoolExecutor(len(satellites)) as pool:
+        list(pool.map(attempt, satellites))
+
+def process(args):
+    #process the data already downloaded and store the layers for the stitch command
+    from scheduler import create_satellites, process
+    from store import LayerStore
+
+    layer_store = LayerStore()
+
+    for satellite in create_satellites(args.satellites):
+        fingerprint = satellite.input_fingerprint()
+
+        if (not args.force and layer_store.fingerprints().get(satellite.satellite) == fingerprint):
+            print(f'{satellite.satellite} input is unchanged, skipping processing.')
+            continue
+
+        layer_store.save_layer(satellite.satellite, process(satellite), fingerprint)
+
+def stitch(args):
+    #full mosaic of the stored layers, or of the projected images when there are none
+    from helpers import stitch_images
+    from store import LayerStore
+
+    layers = LayerStore().layers()
+    layers = {satellite: layer for satellite, layer in layers.items() if satellite in args.satellites}
+    mosaic = stitch_images(layers or None, weighted=args.weighted)
+
+    if (args.tiles):
+        from tiles import build_tiles
+        build_tiles(mosaic)
+
+def masks(args):
+    from masks import convert_text_masks, get_alpha_mask
+
+    if (args.convert):
+        convert_text_masks()
+
+    for satellite in args.satellites:
+        start = time.perf_counter()
+        get_alpha_mask(satellite, args.area, args.lim, args.max_angle, overwrite=args.overwrite)
+        print(f'{satellite} mask ready in {time.perf_counter() - start:.2f} s.')
+
+def import_cost(module):
+    #cumulative import time in microseconds of every package imported by a module, from a fresh
+    #interpreter with -X importtime. Packages overlap when one imports another
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    total = 0
+    costs = {}
+
+    for line in result.stderr.splitlines():
+        if (not line.startswith('import time:') or 'cumulative' in line):
+            continue
+
+        _, cumulative, name = line.split('|')
+        package = name.strip().split('.')[0]
+
+        #the outermost import of a package is the one that includes all of its submodules
+        if (package == module):
+            total = max(total, int(cumulative))
+        else:
+            costs[package] = max(costs.get(package, 0), int(cumulative))
+
+    return total, sorted(((cost, package) for package, cost in costs.items()), reverse=True)
+
+def imports(args):
+    for module in args.modules:
+        total, costs = import_cost(module)
+        print(f'{module:<12} {total / 1e6:6.2f} s')
+
+        for cost, name in costs[:args.top]:
+            print(f'    {name:<28} {cost / 1e6:6.3f} s')
+
+def parser():
+    parser = argparse.ArgumentParser(prog='earth-now', description='Download geostationary satellite data and build the global mosaic.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    satellites = argparse.ArgumentParser(add_help=False)
+    satellites.add_argument('--satellites', nargs='+', choices=SATELLITES, default=SATELLITES)
+
+    command = commands.add_parser('run', parents=[satellites], help='download, process and stitch')
+    command.add_argument('--full', action='store_true', help='process every satellite and blend the whole mosaic')
+    command.add_argument('--daemon', action='store_true', help='keep running and start a cycle whenever new data lands')
+    command.add_argument('--poll-interval', type=float, default=60.)
+    command.add_argument('--max-cycles', type=int, default=None)
+    command.set_defaults(function=run)
+
+    command = commands.add_parser('download', parents=[satellites], help='download the latest data')
+    command.set_defaults(function=download)
+
+    command = commands.add_parser('process', parents=[satellites], help='project the downloaded data into layers')
+    command.add_argument('--force', action='store_true', help='process even if the input did not change')
+    command.set_defaults(function=process)
+
+    command = commands.add_parser('stitch', parents=[satellites], help='blend the layers into the mosaic')
+    command.add_argument('--weighted', action='store_true')
+    command.add_argument('--tiles', action='store_true', help='also write the tile pyramid')
+    command.set_defaults(function=stitch)
+
+    command = commands.add_parser('masks', parents=[satellites], help='generate the alpha masks')
+    command.add_argument('--area', default='worldeqc3km73')
+    command.add_argument('--lim', type=float, default=70.)
+    command.add_argument('--max-angle', type=float, default=85.)
+    command.add_argument('--overwrite', action='store_true')
+    command.add_argument('--convert', action='store_true', help='convert old text masks first')
+    command.set_defaults(function=masks)
+
+    command = commands.add_parser('imports', help='report the import cost of the modules')
+    command.add_argument('modules', nargs='*', default=MODULES)
+    command.add_argument('--top', type=int, default=5)
+    command.set_defaults(function=imports)
+
+    return parser
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.function(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+#the modules live at the top of the repository, pytest adds this directory to the path for the tests
+import os
+
+#timing spans of the tests are not mixed into the log of real runs
+os.environ.setdefault('EARTH_NOW_TIMINGS', os.devnull)
@@ -0,0 +1,146 @@
+from scheduler import create_budget, create_satellites, process_satellites, process_workers, publish, start_process_pool
+from archive import MosaicArchive
+from store import LayerStore
+from profiling import profile, set_cycle, span
+from multiprocessing import cpu_count
+from concurrent.futures.process import BrokenProcessPool
+import argparse
+import traceback
+import time
+
+#seconds between two polls of the data sources. The bucket listings are cached for about as long
+POLL_INTERVAL = 60.
+
+def warm_caches(satellites):
+    #create the masks and resampling lookup tables that are still missing, once in the daemon process
+    #before the workers start, so they never compute the same files at the same time. The workers
+    #memory map the files every cycle, which is cheap since they stay in the page cache
+    from satpy.resample import get_area_def
+    from masks import load_alpha_mask
+    from resample_cache import get_lut
+
+    area = get_area_def('worldeqc3km73')
+
+    for satellite in satellites:
+        #a missing file is created by the worker instead
+        try:
+            load_alpha_mask(satellite.satellite, mask_dir=satellite.website_dir_pre + 'images/projected/blended_overlays/')
+            source_area = satellite.kwargs['resample_area']
+
+            #the meteosat native area is only known once a file is read
+            if (source_area != 'none'):
+                get_lut(source_area, area, satellite.local_dir_pre + 'data/resample_cache/')
+        except Exception as error:
+            print(f'Failed to prepare the {satellite.satellite} caches: {error}')
+
+class Daemon:
+    #resident version of the scheduler. The satellites (with their S3 clients, listings, HTTP sessions
+    #and EUMETSAT token) and the worker processes are kept between cycles. A cycle starts as soon as
+    #a poll finds new data, and only the satellites with new data are downloaded and processed. The
+    #others keep their stored layer, and the mosaic is only recomposed where the new layers are visible
+    def __init__(self, satellites=None, poll_interval=POLL_INTERVAL, archive=None, layer_store=None) -> None:
+        self.satellites = satellites or create_satellites()
+        self.poll_interval = poll_interval
+        self.archive = archive or MosaicArchive()
+        self.workers = process_workers(len(self.satellites))
+        self.budget = create_budget(self.workers)
+        self.layer_store = layer_store or LayerStore()
+        #latest data seen by the poll and fingerprint of the last processed input, per satellite
+        self.seen = {}
+        self.fingerprints = self.layer_store.fingerprints()
+        self.process_pool = None
+
+        for satellite in self.satellites:
+            satellite.num_workers = max(1, cpu_count() // self.workers)
+
+    def poll(self):
+        #satellites with data newer than what was last processed, with the identifier of that data
+        updated = {}
+
+        for satellite in self.satellites:
+            try:
+                latest = satellite.latest_available()
+            except Exception as error:
+                print(f'Failed to poll {satellite.satellite}: {error}')
+                continue
+
+            if (latest != self.seen.get(satellite.satellite)):
+                updated[satellite] = latest
+
+        return updated
+
+    def run_cycle(self, updated):
+        cycle = set_cycle()
+
+        with span('cycle') as record, profile(f'cycle_{cycle}'):
+            layers = process_satellites(list(updated), self.process_pool, self.budget, self.fingerprints)
+
+            #None means the input did not change after all
+            published = {satellite: layer for satellite, layer in layers.items() if layer is not None}
+
+            if (published):
+                publish(published, self.archive, self.layer_store, self.fingerprints)
+
+            #failed satellites, and satellites whose download failed or is incomplete (their unchanged
+            #input is skipped), are retried on the next poll
+            for satellite, latest in updated.items():
+                if (satellite.satellite in layers and satellite.has_latest(latest)):
+                    self.seen[satellite.satellite] = latest
+
+        print(f'Cycle {cycle} finished in {record["seconds"] / 60.:.2f} minutes.')
+
+    def start_pool(self):
+        #the workers are forked after the caches are warmed, so they start with satpy already imported
+        if (self.process_pool is not None):
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+        self.process_pool = start_process_pool(self.workers)
+
+    def check_pool(self):
+        #a worker that dies (e.g. killed when out of memory) breaks the whole pool, so it is
+        #replaced before the next cycle instead of failing every cycle from then on
+        try:
+            self.process_pool.submit(int).result()
+        except BrokenProcessPool:
+            print('The worker processes stopped, restarting them.')
+            self.start_pool()
+
+    def run(self, max_cycles=None):
+        cycles = 0
+        warm_caches(self.satellites)
+        self.start_pool()
+
+        try:
+            while (max_cycles is None or cycles < max_cycles):
+                start = time.monotonic()
+                updated = self.poll()
+
+                if (updated):
+                    print(f'New data for {", ".join(satellite.satellite for satellite in updated)}.')
+                    self.check_pool()
+
+                    #a failed cycle is logged and its satellites are retried on the next poll
+                    try:
+                        self.run_cycle(updated)
+                    except Exception as error:
+                        print(f'Cycle failed: {error!r}')
+                        traceback.print_exc()
+                        #the processed fingerprints were not stored with their layers
+                        self.fingerprints = self.layer_store.fingerprints()
+
+                    cycles += 1
+
+                    if (cycles == max_cycles):
+                        break
+
+                time.sleep(max(0., self.poll_interval - (time.monotonic() - start)))
+        finally:
+            self.process_pool.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run earth-now as a resident service that processes new data as it lands.')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help='seconds between polls of the data sources')
+    parser.add_argument('--max-cycles', type=int, default=None, help='exit after this many cycles')
+    args = parser.parse_args()
+
+    Daemon(poll_interval=args.poll_interval).run(args.max_cycles)
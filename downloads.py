@@ -0,0 +1,242 @@
+from atomic import atomic_path
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore import UNSIGNED
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from datetime import datetime
+import re
+import requests
+import time
+
+MAX_WORKERS = 16
+
+#the data files are between a few and a few hundred MB, so split the large ones into
+#parts that are fetched in parallel, but keep the small ones as single requests
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=4, use_threads=True)
+
+#boto3 clients are thread safe, so all satellites share one client (and connection pool) per endpoint
+_clients = {}
+
+def get_s3_client(endpoint_url=None, max_pool_connections=MAX_WORKERS * 4):
+    #the NOAA buckets are public, so requests are unsigned. endpoint_url allows pointing
+    #the client at a local S3 stand-in (moto, MinIO) for testing
+    if (endpoint_url not in _clients):
+        config = Config(signature_version=UNSIGNED, max_pool_connections=max_pool_connections,
+                        retries={'max_attempts': 3, 'mode': 'standard'})
+        _clients[endpoint_url] = boto3.client('s3', config=config, endpoint_url=endpoint_url)
+
+    return _clients[endpoint_url]
+
+#HS_H09_20230601_0000_B01_FLDK_R10_S0110.DAT.bz2
+HIMAWARI_KEY = re.compile(r'_(?P<start>\d{8}_\d{4})_(?P<band>B\d{2})_.*_S(?P<segment>\d{2})\d{2}\.DAT')
+#OR_ABI-L1b-RadF-M6C01_G16_s20231520000205_e20231520009513_c20231520009556.nc
+GOES_KEY = re.compile(r'-M\d(?P<band>C\d{2})_G\d{2}_s(?P<start>\d{13})')
+
+def parse_key(key):
+    #extract the band, segment and scan start time from a Himawari or GOES key.
+    #Returns None for keys that follow neither naming convention
+    name = key.split('/')[-1]
+    match = HIMAWARI_KEY.search(name)
+
+    try:
+        if (match):
+            start = datetime.strptime(match['start'], '%Y%m%d_%H%M')
+            return {'band': match['band'], 'segment': int(match['segment']), 'start': start}
+
+        match = GOES_KEY.search(name)
+
+        if (match):
+            start = datetime.strptime(match['start'], '%Y%j%H%M%S')
+            return {'band': match['band'], 'segment': None, 'start': start}
+    except ValueError:
+        pass
+
+    return None
+
+class S3ListingIndex:
+    #paginated listing of a bucket prefix, indexed by band, segment and scan start time.
+    #Listings are cached for ttl seconds so the folder search and every channel lookup
+    #of a cycle share a single set of list_objects_v2 calls
+    def __init__(self, client, bucket, ttl=60.) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.ttl = ttl
+        self._cache = {}
+
+    def list(self, prefix):
+        cached = self._cache.get(prefix)
+
+        if (cached is not None and time.monotonic() - cached[0] < self.ttl):
+            return cached[1]
+
+        entries = []
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for content in page.get('Contents', []):
+                entry = {'key': content['Key'], 'size': content['Size'], 'etag': content.get('ETag', '').strip('"'),
+                         'last_modified': content['LastModified']}
+                parsed = parse_key(content['Key'])
+
+                if (parsed is not None):
+                    entry.update(parsed)
+
+                entries.append(entry)
+
+        self._cache[prefix] = (time.monotonic(), entries)
+        return entries
+
+    def channel_files(self, prefix, channel):
+        entries = self.list(prefix)
+        return [entry for entry in entries if entry.get('band', None) == channel or ('band' not in entry and channel in entry['key'])]
+
+    def latest_channel_files(self, prefix, channel):
+        #all files (segments) of the most recent scan of a channel
+        entries = self.channel_files(prefix, channel)
+
+        if (not entries):
+            return []
+
+        latest = max(entry.get('start') or entry['last_modified'].replace(tzinfo=None) for entry in entries)
+        return [entry for entry in entries if (entry.get('start') or entry['last_modified'].replace(tzinfo=None)) == latest]
+
+    def clear(self):
+        self._cache = {}
+
+def _is_missing(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey')
+
+class S3Downloader:
+    def __init__(self, client, bucket, max_workers=MAX_WORKERS, retries=3, backoff=1., transfer_config=TRANSFER_CONFIG) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.transfer_config = transfer_config
+        self.stats = []
+
+    def download(self, key, local_path):
+        #download to a temporary name and rename it once complete, so a partial file
+        #is never picked up as data. Failed attempts are retried with exponential backoff
+        local_path = Path(local_path)
+
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+
+            try:
+                with atomic_path(local_path) as tmp_path:
+                    self.client.download_file(self.bucket, key, str(tmp_path), Config=self.transfer_config)
+
+                break
+            except Exception as error:
+                #a missing key will not appear by retrying
+                if (attempt == self.retries or _is_missing(error)):
+                    raise
+
+                time.sleep(self.backoff * 2 ** attempt)
+
+        seconds = time.perf_counter() - start
+        size = local_path.stat().st_size
+        stats = {'key': key, 'path': str(local_path), 'bytes': size, 'seconds': seconds, 'attempts': attempt + 1}
+        print(f'Downloaded {key} ({size / 1e6:.1f} MB in {seconds:.2f} s, {size / 1e6 / max(seconds, 1e-6):.1f} MB/s)')
+        return stats
+
+    def download_many(self, files):
+        #files is a list of (key, local_path) pairs, downloaded concurrently with a bounded
+        #number of workers. Every transfer is allowed to finish before the first error is raised
+        start = time.perf_counter()
+        errors = []
+        self.stats = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.download, key, local_path) for key, local_path in files]
+
+            for future in futures:
+                try:
+                    self.stats.append(future.result())
+                except Exception as error:
+                    errors.append(error)
+
+        total_bytes = sum(stats['bytes'] for stats in self.stats)
+        seconds = time.perf_counter() - start
+        print(f'Downloaded {len(self.stats)}/{len(files)} files from {self.bucket} '
+              f'({total_bytes / 1e6:.1f} MB in {seconds:.2f} s)')
+
+        if (errors):
+            raise errors[0]
+
+        return self.stats
+
+class HTTPDownloader:
+    #streaming downloader for large single files (the SEVIRI native products). Data is written in
+    #large buffered chunks to a .part file, an interrupted transfer is resumed with an HTTP range
+    #request, and the file is only renamed into place once its size matches what the server announced
+    def __init__(self, session=None, chunk_size=8 * 1024 * 1024, retries=3, backoff=1., timeout=60.) -> None:
+        self.session = session or requests.Session()
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def download(self, url, local_path, headers=None):
+        local_path = Path(local_path)
+        start = time.perf_counter()
+
+        #the .part file is kept when an attempt fails, so the next attempt (or the next cycle)
+        #resumes where this one stopped
+        with atomic_path(local_path, keep_partial=True) as tmp_path:
+            for attempt in range(self.retries + 1):
+                try:
+                    size = self._transfer(url, tmp_path, dict(headers or {}))
+                    break
+                except requests.exceptions.HTTPError as error:
+                    #client errors (other than a stale range) will not be fixed by retrying
+                    if (attempt == self.retries or error.response.status_code < 500):
+                        raise
+                except (requests.exceptions.RequestException, OSError, ValueError):
+                    if (attempt == self.retries):
+                        raise
+
+                time.sleep(self.backoff * 2 ** attempt)
+
+        seconds = time.perf_counter() - start
+        print(f'Downloaded {local_path.name} ({size / 1e6:.1f} MB in {seconds:.2f} s, {size / 1e6 / max(seconds, 1e-6):.1f} MB/s)')
+        return {'key': url, 'path': str(local_path), 'bytes': size, 'seconds': seconds, 'attempts': attempt + 1}
+
+    def _transfer(self, url, tmp_path, headers):
+        offset = tmp_path.stat().st_size if tmp_path.exists() else 0
+
+        if (offset):
+            headers['Range'] = f'bytes={offset}-'
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if (response.status_code == 416):
+                #the partial file does not match the remote one anymore, start over
+                tmp_path.unlink()
+                raise ValueError(f'Range not satisfiable for {url}.')
+
+            response.raise_for_status()
+
+            if (response.status_code == 206):
+                total = int(response.headers['Content-Range'].split('/')[-1])
+                mode = 'ab'
+            else:
+                #the server ignored the range request and is sending the whole file
+                total = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+                mode = 'wb'
+
+            with open(tmp_path, mode, buffering=self.chunk_size) as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+
+        size = tmp_path.stat().st_size
+
+        if (total is not None and size != total):
+            raise ValueError(f'Incomplete download of {url}: {size} of {total} bytes.')
+
+        return size
@@ -0,0 +1,83 @@
+from atomic import atomic_write
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from pathlib import Path
+from profiling import span
+import cv2
+import time
+
+#file extension and OpenCV encoder parameters of every kind of output. Published images are
+#progressive JPEG or WebP, images that are only read back by the next processing step favour
+#encoding speed over size
+PRESETS = {
+    'jpg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 90, cv2.IMWRITE_JPEG_PROGRESSIVE, 1, cv2.IMWRITE_JPEG_OPTIMIZE, 1]),
+    'jpg_full': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 100]),
+    'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 90]),
+    'png': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 6]),
+    #without parameters OpenCV picks its fastest png settings, faster than any explicit level
+    'png_fast': ('.png', []),
+}
+#preset of the published mosaic
+MOSAIC_PRESET = 'jpg'
+#preset of the intermediate images of the file based pipeline
+INTERMEDIATE_PRESET = 'png_fast'
+
+def _to_bgr(image, extension):
+    #OpenCV expects BGR(A), and jpeg has no alpha channel
+    if (image.ndim == 2):
+        return image
+
+    if (image.shape[2] == 4 and extension != '.jpg'):
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+
+    return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR if image.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+
+def encode(image, path, preset=INTERMEDIATE_PRESET, satellite=None):
+    #encode an RGB(A) uint8 array and write it to a temporary file that is renamed once complete,
+    #so a half written image is never served. The encode time and size are recorded as a timing span
+    extension, parameters = PRESETS[preset]
+    path = Path(path)
+
+    if (path.suffix.lower() != extension):
+        raise ValueError(f'Preset {preset} encodes {extension} files, not {path.name}.')
+
+    with span('encode', satellite) as record:
+        start = time.perf_counter()
+        success, buffer = cv2.imencode(extension, _to_bgr(image, extension), parameters)
+
+        if (not success):
+            raise ValueError(f'Failed to encode {path}.')
+
+        record['encode_seconds'] = round(time.perf_counter() - start, 4)
+        atomic_write(path, lambda file: file.write(buffer))
+        record.update({'path': str(path), 'preset': preset, 'bytes': buffer.size})
+
+    print(f'Encoded {path} ({record["bytes"] / 1e6:.1f} MB in {record["encode_seconds"]:.2f} s).')
+    return record
+
+class Encoder:
+    #pool of encoding threads. OpenCV releases the GIL while encoding, so independent outputs are
+    #encoded at the same time. Use as a context manager, leaving it waits for every output
+    def __init__(self, workers=None) -> None:
+        self.pool = ThreadPoolExecutor(workers or cpu_count())
+        self.futures = []
+
+    def submit(self, image, path, preset=INTERMEDIATE_PRESET, satellite=None):
+        future = self.pool.submit(encode, image, path, preset, satellite)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        #records of every output submitted so far, raising the first error
+        futures, self.futures = self.futures, []
+        return [future.result() for future in futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if (exc_type is None):
+                self.wait()
+        finally:
+            self.pool.shutdown(wait=True)
@@ -1,12 +1,8 @@
-from satellites import GOES, Himawari, Meteosat
-from satpy.modifiers import angles
-from satpy.utils import debug_on 
-from satpy.resample import get_area_def
-from pyresample import create_area_def
-from download_sat_data import remove_files
-from glob import glob
-from dask import config
-from xarray import DataArray
+from masks import alpha_from_zenith, get_alpha_mask, mask_cache_path, save_mask
+from mosaic import LAYER_ORDER, blend_layers, footprint, recompose
+from profiling import timed
+from encoding import MOSAIC_PRESET, encode
+from pathlib import Path
 import numpy as np
 from PIL import Image
 import cv2
@@ -15,64 +11,84 @@ import cv2
 local_dir_pre = '' 
 website_dir_pre = ''
 
-def create_alpha_masks(satellite, scn, image_type):
-    #it is good practice to send only individual channels to this function because Himawari breaks
-    #for composites, but works for single channels. It is also much faster to do it this way
-    zenith_angles = angles.get_satellite_zenith_angle(scn[image_type])
-    angle = zenith_angles.to_numpy().astype(dtype=np.float32)
-    shape = angle.shape
-    alpha_vals = np.empty(shape).astype(dtype=np.float32)
-    lim = 70.
-    max_angle = 85.
-
-    #code to generate an "alpha image". Angle values are normalized to between a limit value
-    #and a maximum angle value. The fine tuning of these parameters allows one to create an
-    #alpha gradient near the edge of the image.
-    for i in range(0, shape[0]):
-        for j in range(0, shape[1]):
-            if (angle[i, j] > lim and angle[i, j] < max_angle):
-                alpha_vals[i, j] = 255 * (1. - ((angle[i, j] - lim) / (max_angle - lim)))
-            elif(angle[i, j] > max_angle):
-                alpha_vals[i, j] = 0
-            else:
-                alpha_vals[i, j] = 255
-    
-    np.savetxt(f'images/projected/blended_overlays/{satellite}_alpha_mask.txt', alpha_vals)
+def create_alpha_masks(satellite, scn=None, image_type=None, area='worldeqc3km73', lim=70., max_angle=85.):
+    #if a scene is given, the zenith angles are taken from it. It is good practice to send only individual
+    #channels to this function because Himawari breaks for composites, but works for single channels.
+    #Without a scene, the angles are computed directly from the area definition and the satellite longitude
+    if (scn is not None):
+        from satpy.modifiers import angles
+
+        zenith_angles = angles.get_satellite_zenith_angle(scn[image_type])
+        #angle values are normalized to between a limit value and a maximum angle value. The fine tuning
+        #of these parameters allows one to create an alpha gradient near the edge of the image.
+        alpha_vals = alpha_from_zenith(zenith_angles.to_numpy(), lim, max_angle)
+        area_id = scn[image_type].attrs['area'].area_id
+        save_mask(mask_cache_path(satellite, area_id, lim, max_angle), alpha_vals)
+    else:
+        alpha_vals = get_alpha_mask(satellite, area, lim, max_angle, overwrite=True)
+
+    return alpha_vals
 
 def combine_images(image1, image2, filename):
     background = Image.open(image1)
     foreground = Image.open(image2)
     Image.alpha_composite(background, foreground).save(filename)
 
-def stitch_images():
-    goes_east = website_dir_pre +   'images/projected/goes_east_projected.png'
-    goes_west = website_dir_pre +   'images/projected/goes_west_projected.png'
-    himawari =  website_dir_pre +   'images/projected/himawari_projected.png'
-    meteosat_9 = website_dir_pre +  'images/projected/meteosat_9_projected.png'
-    meteosat_10 = website_dir_pre + 'images/projected/meteosat_10_projected.png'
-    goes_comb = website_dir_pre + 'images/projected/tmp/goes_comb.png'
-    gh_comb = website_dir_pre +   'images/projected/tmp/gh_comb.png'
-    m_comb = website_dir_pre +    'images/projected/tmp/m_comb.png'
-    stitched = website_dir_pre +  'images/projected/global_mosaic.png'
-    background = website_dir_pre + 'images/projected/blended_overlays/background.png'
-
-    #first, combine goes west and goes east images
-    #then combine this image with himawari
-    #then combine meteosat images
-    #then overlay the goes/himawari images on top of meteosat ones.
-    combine_images(goes_east, goes_west, goes_comb)
-    combine_images(goes_comb, himawari, gh_comb)
-    combine_images(meteosat_9, meteosat_10, m_comb)
-    combine_images(m_comb, gh_comb, stitched)
-    rem_files = glob(website_dir_pre + 'images/projected/tmp/*')
-    remove_files(rem_files)
-    #Load .png image
-    image = cv2.imread(stitched)
+@timed('stitch_images', bytes_of=lambda args, result: result.nbytes)
+def stitch_images(layers=None, masks=None, weighted=False):
+    #if the projected layers are passed in as RGBA arrays (in memory mode), nothing but
+    #the final mosaic is read from or written to disk
+    if (layers is None):
+        layers = {}
+
+        for satellite in LAYER_ORDER:
+            projected = website_dir_pre + f'images/projected/{satellite}_projected.png'
+
+            #a missing feed leaves a gap in the mosaic instead of crashing the run
+            if (not Path(projected).exists()):
+                print(f'{satellite} projected image not found, skipping.')
+                continue
+
+            layers[satellite] = np.array(Image.open(projected).convert('RGBA'))
+
+    return stitch_layers(layers, masks, weighted)
+
+def stitch_layers(layers, masks=None, weighted=False):
+    #meteosat images go on the bottom, then goes east, goes west and himawari on top.
+    #With weighted=True, overlapping footprints are averaged by their zenith masks instead
+    stitched = blend_layers(layers, masks, weighted=weighted)
+    write_mosaic(stitched)
+    return stitched
+
+@timed('stitch_incremental', bytes_of=lambda args, result: result.nbytes)
+def stitch_incremental(layer_store, updated, masks=None, weighted=False):
+    #updated is a dict of satellite -> (layer, input fingerprint) of the satellites processed this
+    #cycle. They replace their previous layer in the store, and the stored mosaic is blended again
+    #only where they are visible. The alpha channel of a layer is its fixed zenith mask, so its
+    #footprint is the same every cycle
+    for satellite, (layer, fingerprint) in updated.items():
+        layer_store.save_layer(satellite, layer, fingerprint)
+
+    layers = layer_store.layers()
+    mosaic = layer_store.mosaic(layers)
+
+    if (mosaic is None):
+        #first cycle, or the set of satellites changed
+        mosaic = blend_layers(layers, masks, weighted=weighted)
+    else:
+        masks = masks or {}
+        boxes = [box for satellite in updated for box in footprint(masks.get(satellite, layers[satellite][:, :, 3]))]
+        recompose(mosaic, layers, boxes, masks, weighted=weighted)
+
+    layer_store.save_mosaic(mosaic, layers)
+    write_mosaic(mosaic)
+    return mosaic
+
+def write_mosaic(mosaic):
     out_name = website_dir_pre + 'images/projected/global_mosaic.jpg'
-    #combine_images(background, stitched, stitched)
-    cv2.imwrite(out_name, image, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
-    remove_files([stitched])
-        
+    #written atomically, so the web server never serves a half written mosaic
+    encode(mosaic, out_name, MOSAIC_PRESET)
+
 def generate_background():
     data = np.full((2048, 4096, 3), 0, dtype=np.uint8)
     jpg = Image.fromarray(data, 'RGB')
@@ -83,29 +99,9 @@ def generate_background():
     # Then assign the mask to the last channel of the image
     rgba[:, :, 3] = alpha_vals
     cv2.imwrite('images/projected/blended_overlays/background.png', rgba)
-    remove_files(['images/projected/blended_overlays/background.jpg'])
-
-#Uncomment to download data and generate alpha masks for each satellite
-"""goes_east = GOES('goes_east', ['C01'], True)
-goes_west = GOES('goes_west', ['C01'], True)
-himawari = Himawari('himawari', ['B01'], True)
-meteosat_9 = Meteosat('meteosat_9', ['VIS006'], True)
-meteosat_10 = Meteosat('meteosat_10', ['VIS006'], True)
-
-goes_east.download_data()
-goes_west.download_data()
-himawari.download_data()
-meteosat_9.download_data()
-meteosat_10.download_data()
-
-goes_east_scn = goes_east._generate_image_from_data()
-goes_west_scn = goes_west._generate_image_from_data()
-himawari_scn = himawari._generate_image_from_data()
-meteosat_9_scn = meteosat_9._generate_image_from_data()
-meteosat_10_scn = meteosat_10._generate_image_from_data()
-
-create_alpha_masks('goes_east', goes_east_scn, 'C01')
-create_alpha_masks('goes_west', goes_west_scn, 'C01')
-create_alpha_masks('himawari', himawari_scn, 'B01')
-create_alpha_masks('meteosat_9', meteosat_9_scn, 'VIS006')
-create_alpha_masks('meteosat_10', meteosat_10_scn, 'VIS006')"""
+    Path('images/projected/blended_overlays/background.jpg').unlink()
+
+#Uncomment to generate alpha masks for each satellite. The zenith angles are computed
+#from the worldeqc3km73 area definition, so no data has to be downloaded
+"""for satellite in ['goes_east', 'goes_west', 'himawari', 'meteosat_9', 'meteosat_10']:
+    create_alpha_masks(satellite)"""
@@ -0,0 +1,121 @@
+from atomic import atomic_write
+from pathlib import Path
+import numpy as np
+
+#sub-satellite longitudes (degrees east) of the satellites used in the mosaic
+SATELLITE_LONGITUDES = {
+    'goes_east': -75.2,
+    'goes_west': -137.2,
+    'himawari': 140.7,
+    'meteosat_9': 45.5,
+    'meteosat_10': 0.0,
+}
+
+#geostationary orbit radius and WGS84 ellipsoid, all in meters
+GEO_RADIUS = 42164160.0
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+MASK_DIR = 'images/projected/blended_overlays/'
+
+def alpha_from_zenith(angle, lim=70., max_angle=85.):
+    #vectorized version of the alpha ramp: fully opaque up to lim, fully transparent past max_angle
+    #and a linear falloff in between. Values are truncated to uint8 like the old alpha channel assignment
+    angle = np.asarray(angle, dtype=np.float32)
+    alpha = 255. * (1. - ((angle - lim) / (max_angle - lim)))
+    np.clip(alpha, 0., 255., out=alpha)
+    #pixels without a valid angle (off the earth) are never shown
+    alpha[np.isnan(angle)] = 0.
+    return alpha.astype(np.uint8)
+
+def satellite_zenith_angles(sub_lon, area):
+    #compute the satellite zenith angle of every pixel of an area definition for a geostationary
+    #satellite at the given sub-satellite longitude. No scene or raw data is required
+    lons, lats = area.get_lonlats()
+    lons = np.deg2rad(lons.astype(np.float32))
+    lats = np.deg2rad(lats.astype(np.float32))
+    sub_lon = np.deg2rad(sub_lon)
+
+    cos_lat, sin_lat = np.cos(lats), np.sin(lats)
+    cos_lon, sin_lon = np.cos(lons), np.sin(lons)
+    del lons, lats
+
+    #earth-centered coordinates of the ground pixel on the ellipsoid
+    radius = WGS84_A / np.sqrt(1. - WGS84_E2 * sin_lat ** 2)
+    dx = GEO_RADIUS * np.cos(sub_lon) - radius * cos_lat * cos_lon
+    dy = GEO_RADIUS * np.sin(sub_lon) - radius * cos_lat * sin_lon
+    dz = -radius * (1. - WGS84_E2) * sin_lat
+    del radius
+
+    #angle between the local (geodetic) vertical and the line of sight to the satellite
+    cos_zenith = (dx * cos_lat * cos_lon + dy * cos_lat * sin_lon + dz * sin_lat) / np.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
+    np.clip(cos_zenith, -1., 1., out=cos_zenith)
+    return np.rad2deg(np.arccos(cos_zenith))
+
+def mask_cache_path(satellite, area_id, lim=70., max_angle=85., mask_dir=MASK_DIR):
+    return Path(mask_dir) / f'{satellite}_{area_id}_{lim:g}_{max_angle:g}_alpha_mask.npy'
+
+def save_mask(cache_file, alpha_vals):
+    #another process never memory maps a half written mask
+    atomic_write(cache_file, lambda file: np.save(file, alpha_vals))
+
+def get_alpha_mask(satellite, area='worldeqc3km73', lim=70., max_angle=85., mask_dir=MASK_DIR, overwrite=False, mmap_mode=None):
+    #return the alpha mask of a satellite for an area, computing and caching it on disk if needed
+    area_id = area if isinstance(area, str) else area.area_id
+    cache_file = mask_cache_path(satellite, area_id, lim, max_angle, mask_dir)
+
+    if (cache_file.exists() and not overwrite):
+        return np.load(cache_file, mmap_mode=mmap_mode)
+
+    if (isinstance(area, str)):
+        #satpy is only imported when a mask actually has to be computed
+        from satpy.resample import get_area_def
+        area = get_area_def(area)
+
+    try:
+        sub_lon = SATELLITE_LONGITUDES[satellite]
+    except KeyError:
+        raise ValueError('Invalid satellite option. Use "himawari", "goes_east", "goes_west", meteosat_10, or meteosat_9 instead.')
+
+    alpha_vals = alpha_from_zenith(satellite_zenith_angles(sub_lon, area), lim, max_angle)
+    save_mask(cache_file, alpha_vals)
+
+    if (mmap_mode is not None):
+        return np.load(cache_file, mmap_mode=mmap_mode)
+
+    return alpha_vals
+
+def convert_text_mask(text_file, satellite, area_id='worldeqc3km73', lim=70., max_angle=85., mask_dir=MASK_DIR):
+    #one-time conversion of an old np.savetxt alpha mask into the uint8 .npy format.
+    #The text masks were always generated for worldeqc3km73 with the default angles
+    alpha_vals = np.loadtxt(text_file, dtype=np.float32).astype(np.uint8)
+    cache_file = mask_cache_path(satellite, area_id, lim, max_angle, mask_dir)
+    save_mask(cache_file, alpha_vals)
+    return cache_file
+
+def convert_text_masks(mask_dir=MASK_DIR, remove_text=False):
+    #convert every *_alpha_mask.txt in the mask directory that has no binary counterpart yet
+    converted = []
+
+    for text_file in sorted(Path(mask_dir).glob('*_alpha_mask.txt')):
+        satellite = text_file.name[:-len('_alpha_mask.txt')]
+
+        if (not mask_cache_path(satellite, 'worldeqc3km73', mask_dir=mask_dir).exists()):
+            converted.append(convert_text_mask(text_file, satellite, mask_dir=mask_dir))
+
+        if (remove_text):
+            text_file.unlink()
+
+    return converted
+
+def load_alpha_mask(satellite, area='worldeqc3km73', lim=70., max_angle=85., mask_dir=MASK_DIR):
+    #memory map the uint8 mask of a satellite. Old text masks are converted the first time they are
+    #needed, and masks that do not exist at all are generated from the area definition
+    area_id = area if isinstance(area, str) else area.area_id
+    text_file = Path(mask_dir) / f'{satellite}_alpha_mask.txt'
+
+    if (not mask_cache_path(satellite, area_id, lim, max_angle, mask_dir).exists() and text_file.exists()
+            and area_id == 'worldeqc3km73' and (lim, max_angle) == (70., 85.)):
+        convert_text_mask(text_file, satellite, mask_dir=mask_dir)
+
+    return get_alpha_mask(satellite, area, lim, max_angle, mask_dir, mmap_mode='r')
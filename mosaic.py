@@ -0,0 +1,94 @@
+import numpy as np
+
+#stacking order of the layers from bottom to top. This is the order the pairwise
+#alpha composites in stitch_images used to produce
+LAYER_ORDER = ['meteosat_9', 'meteosat_10', 'goes_east', 'goes_west', 'himawari']
+
+def _layer_order(layers, order):
+    #any subset of satellites is accepted, unknown layers go on top in the order they were given
+    if (order is None):
+        order = LAYER_ORDER
+
+    names = [name for name in order if name in layers]
+    names += [name for name in layers if name not in names]
+    return names
+
+def _blend_tile(colors, alphas, weighted):
+    #colors is (n, rows, cols, 3) and alphas is (n, rows, cols, 1), both normalized to [0, 1]
+    transparency = np.prod(1. - alphas, axis=0)
+    out_alpha = 1. - transparency
+
+    if (weighted):
+        #normalized weighted average of every layer that covers the pixel
+        weight_sum = alphas.sum(axis=0)
+        color = (colors * alphas).sum(axis=0) / np.where(weight_sum > 0., weight_sum, 1.)
+        premultiplied = color * out_alpha
+    else:
+        #"over" operator for the whole stack at once: each layer is attenuated
+        #by the transparency of all layers above it
+        above = np.cumprod((1. - alphas)[::-1], axis=0)[::-1]
+        above = np.concatenate([above[1:], np.ones_like(alphas[:1])], axis=0)
+        premultiplied = (colors * alphas * above).sum(axis=0)
+
+    #un-premultiply like PIL's alpha_composite
+    color = premultiplied / np.where(out_alpha > 0., out_alpha, 1.)
+    return np.concatenate([color, out_alpha], axis=-1)
+
+def blend_layers(layers, masks=None, order=None, weighted=False, tile_rows=256):
+    #blend N projected RGBA layers (dict of satellite -> (y, x, 4) uint8 arrays) into one mosaic.
+    #masks optionally overrides the alpha channel of each layer with its zenith mask.
+    #The image is processed in row tiles so only a few full width float rows are held at once
+    if (not layers):
+        raise ValueError('No layers to blend.')
+
+    names = _layer_order(layers, order)
+    masks = masks or {}
+    shape = layers[names[0]].shape
+
+    for name in names:
+        if (layers[name].shape != shape):
+            raise ValueError(f'Layer {name} has shape {layers[name].shape}, expected {shape}.')
+
+    mosaic = np.empty(shape[:2] + (4,), dtype=np.uint8)
+
+    for row in range(0, shape[0], tile_rows):
+        rows = slice(row, min(row + tile_rows, shape[0]))
+        colors = np.stack([layers[name][rows, :, :3] for name in names]).astype(np.float32) / 255.
+        alphas = np.stack([masks[name][rows] if name in masks else layers[name][rows, :, 3] for name in names])
+        alphas = alphas.astype(np.float32)[..., np.newaxis] / 255.
+        tile = _blend_tile(colors, alphas, weighted)
+        mosaic[rows] = np.rint(tile * 255.).astype(np.uint8)
+
+    return mosaic
+
+def footprint(alpha):
+    #boxes (row_start, row_stop, col_start, col_stop) around the visible pixels of a layer, one per
+    #run of visible columns, so a footprint crossing the antimeridian gives two narrow boxes
+    alpha = np.asarray(alpha)
+    columns = np.flatnonzero(alpha.any(axis=0))
+
+    if (columns.size == 0):
+        return []
+
+    breaks = np.flatnonzero(np.diff(columns) > 1)
+    starts = np.concatenate([columns[:1], columns[breaks + 1]])
+    stops = np.concatenate([columns[breaks], columns[-1:]]) + 1
+    boxes = []
+
+    for start, stop in zip(starts, stops):
+        rows = np.flatnonzero(alpha[:, start:stop].any(axis=1))
+        boxes.append((int(rows[0]), int(rows[-1]) + 1, int(start), int(stop)))
+
+    return boxes
+
+def recompose(mosaic, layers, boxes, masks=None, order=None, weighted=False, tile_rows=256):
+    #blend the layers again only inside the given boxes of an existing mosaic, in place.
+    #Pixels outside of the boxes keep their previous value
+    masks = masks or {}
+
+    for row_start, row_stop, col_start, col_stop in boxes:
+        window = (slice(row_start, row_stop), slice(col_start, col_stop))
+        mosaic[window] = blend_layers({name: layer[window] for name, layer in layers.items()},
+                                      {name: mask[window] for name, mask in masks.items()}, order, weighted, tile_rows)
+
+    return mosaic
@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+import cProfile
+import functools
+import json
+import os
+import resource
+import time
+
+#timing spans are appended here as JSON lines, one per stage and satellite
+TIMINGS_FILE = os.environ.get('EARTH_NOW_TIMINGS', 'logs/timings.jsonl')
+#if set, cProfile and dask profiler dumps are written to this directory
+PROFILE_DIR = os.environ.get('EARTH_NOW_PROFILE')
+
+def set_cycle(cycle=None):
+    #the cycle id is kept in the environment so worker processes started afterwards inherit it
+    cycle = cycle or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    os.environ['EARTH_NOW_CYCLE'] = cycle
+    return cycle
+
+def peak_rss_mb():
+    #ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+def emit(record):
+    path = Path(TIMINGS_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    #a single short append per record, so concurrent processes do not interleave lines
+    with open(path, 'a') as file:
+        file.write(json.dumps(record, default=str) + '\n')
+
+@contextmanager
+def span(stage, satellite=None):
+    #time a stage. The caller can add fields (e.g. 'bytes') to the yielded record
+    record = {'time': datetime.now(timezone.utc).isoformat(), 'cycle': os.environ.get('EARTH_NOW_CYCLE'),
+              'pid': os.getpid(), 'stage': stage, 'satellite': satellite}
+    start, cpu_start = time.perf_counter(), time.process_time()
+
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = repr(error)
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+        emit(record)
+
+def timed(stage, bytes_of=None):
+    #decorator version of span. The satellite name is taken from the first argument if it has one,
+    #and bytes_of(args, result) can report the amount of data the stage produced or consumed
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            satellite = getattr(args[0], 'satellite', None) if args else None
+
+            with span(stage, satellite) as record:
+                result = function(*args, **kwargs)
+
+                if (bytes_of is not None):
+                    try:
+                        record['bytes'] = bytes_of(args, result)
+                    except (OSError, TypeError, AttributeError):
+                        record['bytes'] = None
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+def file_bytes(*files):
+    return sum(os.path.getsize(file) for file in files if os.path.exists(file))
+
+@contextmanager
+def profile(name):
+    #cProfile and dask profiler dumps of a block, only when EARTH_NOW_PROFILE is set
+    if (PROFILE_DIR is None):
+        yield
+        return
+
+    from dask.diagnostics import Profiler
+    from dask.utils import key_split
+
+    profile_dir = Path(PROFILE_DIR)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+
+    with Profiler() as dask_profiler:
+        profiler.enable()
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    profiler.dump_stats(profile_dir / f'{name}.prof')
+    #total time per kind of dask task
+    task_seconds = {}
+
+    for task in dask_profiler.results:
+        prefix = key_split(task.key)
+        task_seconds[prefix] = task_seconds.get(prefix, 0.) + task.end_time - task.start_time
+
+    with open(profile_dir / f'{name}_dask.json', 'w') as file:
+        json.dump(dict(sorted(task_seconds.items(), key=lambda item: -item[1])), file, indent=1)
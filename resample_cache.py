@@ -0,0 +1,137 @@
+from atomic import atomic_write
+from pyresample.resampler import BaseResampler
+from satpy.resample import get_area_def
+from xarray import DataArray
+from pathlib import Path
+import hashlib
+import dask.array as da
+import numpy as np
+
+CACHE_DIR = 'data/resample_cache/'
+#target pixels per side of the tiles that are gathered separately from dask arrays
+TILE_SIZE = 512
+
+def area_hash(area):
+    #python's hash() is randomized per process, so build a stable digest from the
+    #projection, extent and shape of the area instead
+    description = f'{area.crs.to_wkt()}{tuple(area.area_extent)}{area.shape}'
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+def lut_cache_path(source_area, target_area, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / f'{source_area.area_id}_{area_hash(source_area)}_to_{target_area.area_id}_{area_hash(target_area)}.npy'
+
+def compute_lut(source_area, target_area):
+    #nearest neighbour lookup table from a gridded source area to the target area. Every target pixel
+    #stores the flat index of the source pixel it falls in, or -1 if it is outside of the source area
+    lons, lats = target_area.get_lonlats()
+    cols, rows = source_area.get_array_indices_from_lonlat(lons, lats)
+    del lons, lats
+    lut = np.ma.filled(rows.astype(np.int32) * np.int32(source_area.shape[1]) + cols.astype(np.int32), -1)
+    return lut.astype(np.int32).reshape(target_area.shape)
+
+def get_lut(source_area, target_area, cache_dir=CACHE_DIR):
+    #the lookup table only depends on the two geometries, which never change between cycles,
+    #so it is computed once and memory mapped afterwards
+    cache_file = lut_cache_path(source_area, target_area, cache_dir)
+
+    if (not cache_file.exists()):
+        lut = compute_lut(source_area, target_area)
+        atomic_write(cache_file, lambda file: np.save(file, lut))
+
+    return np.load(cache_file, mmap_mode='r')
+
+def gather(data, lut):
+    #apply a lookup table to an array whose last two dimensions are (y, x)
+    data = np.asarray(data)
+    lut = np.asarray(lut)
+    flat = data.reshape(data.shape[:-2] + (-1,))
+    valid = lut >= 0
+    out = np.take(flat, np.where(valid, lut, 0), axis=-1)
+
+    if (np.issubdtype(out.dtype, np.floating)):
+        out[..., ~valid] = np.nan
+    else:
+        out[..., ~valid] = 0
+
+    return out
+
+def lut_tiles(lut, source_shape, tile_size=TILE_SIZE):
+    #split a lookup table into target tiles. Each tile keeps the bounding box of the source pixels it
+    #reads, and its lookup table relative to that box, or None if no source pixel falls in the tile
+    tiles = []
+
+    for y in range(0, lut.shape[0], tile_size):
+        row = []
+
+        for x in range(0, lut.shape[1], tile_size):
+            tile = np.asarray(lut[y:y + tile_size, x:x + tile_size])
+            valid = tile >= 0
+
+            if (not valid.any()):
+                row.append((tile.shape, None, None))
+                continue
+
+            rows, cols = np.divmod(tile[valid], source_shape[1])
+            box = (int(rows.min()), int(rows.max()) + 1, int(cols.min()), int(cols.max()) + 1)
+            local = np.full(tile.shape, -1, dtype=np.int32)
+            local[valid] = (rows - box[0]) * (box[3] - box[2]) + cols - box[2]
+            row.append((tile.shape, box, local))
+
+        tiles.append(row)
+
+    return tiles
+
+def gather_tiled(source, tiles):
+    #lazy gather of a dask array, tile by tile. Every tile only depends on the source blocks inside
+    #its bounding box, so the full resolution (y, x) plane is never held in a single block
+    fill = np.nan if np.issubdtype(source.dtype, np.floating) else 0
+    leading_shape = source.shape[:-2]
+    blocks = []
+
+    for row in tiles:
+        blocks.append([])
+
+        for shape, box, local in row:
+            if (box is None):
+                blocks[-1].append(da.full(leading_shape + shape, fill, dtype=source.dtype))
+                continue
+
+            window = source[..., box[0]:box[1], box[2]:box[3]]
+            window = window.rechunk(window.chunks[:-2] + (-1, -1))
+            blocks[-1].append(da.map_blocks(gather, window, lut=local, dtype=source.dtype,
+                                            chunks=window.chunks[:-2] + tuple((size,) for size in shape)))
+
+    return da.block(blocks)
+
+class LUTResampler(BaseResampler):
+    #nearest neighbour resampler backed by the cached lookup tables. The class can be passed
+    #directly as the resampler argument of Scene.resample, so composites are still generated by satpy
+    def precompute(self, cache_dir=None, **kwargs):
+        #called before every dataset, but satpy reuses the resampler for every dataset on the same
+        #pair of areas, so the lookup table and its tiles are only loaded once
+        if (getattr(self, 'lut', None) is None):
+            self.lut = get_lut(self.source_geo_def, self.target_geo_def, cache_dir or CACHE_DIR)
+            self.tiles = None
+
+    def compute(self, data, **kwargs):
+        source = data.data
+
+        if (isinstance(source, da.Array)):
+            #the tiles are shared by every dataset on the same pair of areas
+            if (self.tiles is None):
+                self.tiles = lut_tiles(self.lut, self.source_geo_def.shape)
+
+            out = gather_tiled(source, self.tiles)
+        else:
+            out = gather(source, self.lut)
+
+        coords = {dim: data.coords[dim] for dim in data.dims if dim not in ('y', 'x') and dim in data.coords}
+        return DataArray(out, dims=data.dims, coords=coords, attrs=data.attrs.copy(), name=data.name)
+
+def resample_scene(scn, target_area, datasets=None, cache_dir=CACHE_DIR):
+    #drop-in replacement for scn.resample(target_area, resampler='nearest') when all
+    #datasets are on gridded areas, using the cached lookup tables as a plain gather
+    if (isinstance(target_area, str)):
+        target_area = get_area_def(target_area)
+
+    return scn.resample(target_area, datasets=datasets, resampler=LUTResampler, reduce_data=False, cache_dir=cache_dir)
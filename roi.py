@@ -0,0 +1,36 @@
+from resample_cache import CACHE_DIR, get_lut
+import numpy as np
+
+#number of full disk segments of the Himawari HSD files
+HIMAWARI_SEGMENTS = 10
+
+def contributing_source_rows(source_area, target_area, mask, cache_dir=CACHE_DIR):
+    #rows of the source area that end up in a visible (nonzero alpha) pixel of the target area,
+    #found through the cached resampling lookup table
+    lut = get_lut(source_area, target_area, cache_dir)
+    indices = lut[(np.asarray(mask) > 0) & (lut >= 0)]
+    return np.unique(indices // source_area.shape[1])
+
+def contributing_rows(source_area, target_area, mask, cache_dir=CACHE_DIR):
+    #first and last (exclusive) source row that contribute to the target area, or None
+    rows = contributing_source_rows(source_area, target_area, mask, cache_dir)
+
+    if (rows.size == 0):
+        return None
+
+    return int(rows[0]), int(rows[-1]) + 1
+
+def contributing_segments(source_area, target_area, mask, n_segments=HIMAWARI_SEGMENTS, cache_dir=CACHE_DIR):
+    #segment numbers (starting at 1, from the north) of a segmented full disk that contain any
+    #contributing row. Every band has the same number of segments, whatever its resolution
+    rows = contributing_source_rows(source_area, target_area, mask, cache_dir)
+    return sorted(set((rows * n_segments // source_area.shape[0] + 1).tolist()))
+
+def row_bbox(area, row_start, row_stop):
+    #bounding box in projection coordinates of a range of full width rows, for Scene.crop(xy_bbox=...).
+    #Works for both north-up and south-up areas
+    ys = area.projection_y_coords
+    half_pixel = area.pixel_size_y / 2.
+    y_values = [ys[row_start], ys[row_stop - 1]]
+    x_ll, _, x_ur, _ = area.area_extent
+    return (min(x_ll, x_ur), min(y_values) - half_pixel, max(x_ll, x_ur), max(y_values) + half_pixel)
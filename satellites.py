@@ -1,13 +1,7 @@
-from satpy import Scene
-from satpy import config
-from satpy.resample import get_area_def
-from pyresample import create_area_def
-import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
-import eumdac
+import dask
 import requests
-import shutil
+import re
+import hashlib
 from glob import glob
 from math import floor
 from datetime import datetime, timezone, timedelta
@@ -15,24 +9,121 @@ from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
+import os
+from urllib.parse import quote
+from masks import load_alpha_mask
+from downloads import HTTPDownloader, S3Downloader, S3ListingIndex, get_s3_client
+from store import SegmentStore
+from segment_cache import decode_segments
+from profiling import file_bytes, profile, timed
+from encoding import Encoder, INTERMEDIATE_PRESET, encode
+from atomic import PART_SUFFIX, partial_path
+
+#satpy, pyresample and eumdac take most of the startup time, so they are only imported by the
+#methods that use them. Creating a satellite and downloading its data does not need them
+
+#EUMETSAT data store download endpoint. Can be pointed at a local server for testing
+EUMETSAT_DOWNLOAD_URL = 'https://api.eumetsat.int/data/download/1.0.0'
+SEVIRI_REPEAT_CYCLE = timedelta(minutes=15)
+#access tokens shared by the Meteosat instances of a process
+_tokens = {}
+
+#number of ten minute steps to search back for the latest bucket folder
+MAX_FOLDER_STEPS = 144
+
+#dask chunk size per reader. Tiny chunks make huge task graphs, so these are much
+#larger than the 1 MiB chunks that were used before
+READER_CHUNK_SIZES = {'ahi_hsd': '32MiB', 'abi_l1b': '64MiB', 'seviri_l1b_native': '64MiB'}
+
+#opaque black backgrounds of the in memory layers, per shape, reused between cycles
+_backgrounds = {}
+
+def latest_ten_minutes():
+    #the most recent multiple of ten minutes, the cadence of the himawari and goes full disk scans
+    now = datetime.now(timezone.utc)
+    return now - timedelta(minutes=(now.minute - floor(now.minute / 10.) * 10.))
+
+def downloaded_bytes(args, result):
+    #download_data returns the stats of the files it downloaded
+    return sum(stats['bytes'] for stats in result or [])
 
 #create a generic class for processing satellite data
 #this class will be inherited by the specific satellite classes
 class Satellite:
-    def __init__(self, satellite, composites, get_projections=False) -> None:
+    def __init__(self, satellite, composites, get_projections=False, in_memory=False) -> None:
         #generate the required channels for the satellite based on the 
         #desired image types (composites)
         self.satellite = satellite
         self.composites = composites
         self.channels = self._generate_channels()
         self.get_projections = get_projections
+        #in memory mode keeps the projected layer as an RGBA array instead of writing intermediate images
+        self.in_memory = in_memory
+        self.layer = None
+        self.use_resample_cache = True
+        #project the raw channels in a single step instead of going through the native area first
+        self.direct_projection = False
+        #only download and read the parts of the disk that are visible through the alpha mask. Himawari
+        #skips whole segments, the other satellites crop their lines when direct_projection is on
+        self.region_of_interest = False
+        #output area (name or area definition) and alpha mask falloff angles that decide what is visible in
+        #region of interest mode. With the global mosaic area every himawari segment is visible, so this only
+        #skips data for a regional area, e.g. one covering Japan only needs segments 1 to 3
+        self.roi_area = 'worldeqc3km73'
+        self.roi_lim = 70.
+        self.roi_max_angle = 85.
+        #dask threads and chunk size used while processing. A chunk size of None uses the reader default
+        self.num_workers = 2
+        self.chunk_size = None
         self.local_dir_pre = ''
         self.website_dir_pre = ''
         self.data_file_path = self.local_dir_pre + f'data/{self.satellite}/'
-        self.kwargs = self._get_satpy_kwargs()
+        #extra images rendered from the same loaded scene, a list of targets.OutputTarget
+        self.targets = []
+        self._kwargs = None
+        #RGBA arrays of the composites enhanced during the current run, shared by the layer and the targets
+        self._rgba_cache = {}
 
+    @property
+    def kwargs(self):
+        #reader and native area, built on first use since the areas need satpy
+        if (self._kwargs is None):
+            self._kwargs = self._get_satpy_kwargs()
+
+        return self._kwargs
+
+    def __getstate__(self):
+        #satellites are sent to worker processes for processing, which does not need the
+        #network clients and tokens (and they cannot be pickled)
+        state = self.__dict__.copy()
+
+        for attribute in ('client', 'downloader', 'listing', 'token'):
+            state.pop(attribute, None)
+
+        return state
+
+    @timed('process_images')
     def process_images(self):
-        self._generate_image_from_data()
+        #dask settings are only applied while this satellite is being processed
+        with self._execution_context(), profile(f'{self.satellite}_process_images'):
+            return self._process_images()
+
+    def _execution_context(self):
+        chunk_size = self.chunk_size or READER_CHUNK_SIZES.get(self.kwargs['reader'], '64MiB')
+        return dask.config.set({'scheduler': 'threads', 'num_workers': self.num_workers, 'array.chunk-size': chunk_size})
+
+    def _process_images(self):
+        try:
+            return self._process_scene()
+        finally:
+            self._rgba_cache = {}
+
+    def _process_scene(self):
+        resampled_scn = self._generate_image_from_data()
+
+        if (self.get_projections == True and self.in_memory == True):
+            self.layer = self._compose_layer(resampled_scn)
+            return self.layer
 
         if(self.get_projections == True):
             base_img = self.website_dir_pre + f'images/projected/{self.satellite}_projected'
@@ -45,6 +136,95 @@ class Satellite:
             self._apply_blending_masks()
             Satellite._remove_files(files)
 
+    @timed('_compose_layer', bytes_of=lambda args, result: result.nbytes)
+    def _compose_layer(self, resampled_scn):
+        #same steps as the file based pipeline, but run on RGBA arrays.
+        #The ir image goes below the other composites
+        mask = load_alpha_mask(self.satellite, mask_dir=self.website_dir_pre + 'images/projected/blended_overlays/')
+        return self._compose_composites(resampled_scn, self.composites, mask)
+
+    def _compose_composites(self, scn, composites, mask=None):
+        #the ir image goes below the other composites
+        composites = sorted(composites, key=lambda composite: composite != 'night_ir_alpha')
+        layer = self._rgba(scn, composites[0])
+
+        for composite in composites[1:]:
+            layer = Satellite._combine_arrays(layer, self._rgba(scn, composite))
+
+        if (mask is None):
+            return layer
+
+        #pixels without any data (like the segments skipped in region of interest mode, which satpy
+        #fills with NaN) stay transparent instead of turning into opaque black
+        mask = np.where(layer[:, :, 3] == 0, np.uint8(0), mask)
+
+        #combine with black background, which replaces the jpg conversion used to drop the alpha channel
+        if (layer.shape not in _backgrounds):
+            _backgrounds[layer.shape] = np.zeros(layer.shape, dtype=np.uint8)
+            _backgrounds[layer.shape][:, :, 3] = 255
+
+        layer = Satellite._combine_arrays(_backgrounds[layer.shape], layer)
+        layer[:, :, 3] = mask
+        return layer
+
+    def _rgba(self, scn, composite):
+        #each composite of a scene is only enhanced once per run
+        key = (id(scn), composite)
+
+        if (key not in self._rgba_cache):
+            self._rgba_cache[key] = Satellite._to_rgba_array(scn[composite])
+
+        return self._rgba_cache[key]
+
+    def _target_composites(self):
+        #composites of the satellite followed by any other composite a target needs
+        composites = list(self.composites)
+
+        for target in self.targets:
+            composites += [composite for composite in target.composites or [] if composite not in composites]
+
+        return composites
+
+    @timed('_render_targets', bytes_of=lambda args, result: file_bytes(*result))
+    def _render_targets(self, scn, native_scn, projected_scn):
+        #render every output target from the scenes that were already loaded and resampled. Each area
+        #is resampled at most once, and targets that only differ in factor share the same image
+        scenes = {'native': native_scn, 'projected': projected_scn}
+        images = {}
+
+        with Encoder(self.num_workers) as encoder:
+            for target in self.targets:
+                composites = target.composites or self.composites
+                key = (target.area, tuple(composites))
+
+                if (key not in images):
+                    if (scenes.get(target.area) is None):
+                        scenes[target.area] = self._target_scene(target.area, scn, scenes['native'], self._target_composites())
+
+                    mask = None
+
+                    if (target.area == 'projected'):
+                        mask = load_alpha_mask(self.satellite, mask_dir=self.website_dir_pre + 'images/projected/blended_overlays/')
+
+                    images[key] = self._compose_composites(scenes[target.area], composites, mask)
+
+                #the next target is rendered while this one is encoded
+                encoder.submit(target.render(images[key]), target.output_path(self.satellite), target.preset, self.satellite)
+
+            return [record['path'] for record in encoder.wait()]
+
+    def _target_scene(self, area, scn, native_scn, composites):
+        #areas that were not produced by the layer pipeline are resampled from the native scene
+        if (native_scn is None):
+            native_area = self.kwargs['resample_area']
+            native_area = scn.coarsest_area() if native_area == 'none' else native_area
+            native_scn = scn.resample(native_area, resampler=self.kwargs['mode'], reduce_data=False)
+
+        if (area == 'native'):
+            return native_scn
+
+        return self._project(native_scn, composites, 'worldeqc3km73' if area == 'projected' else area)
+
     def _generate_channels(self):
         #generate the required channels for the satellite based on the 
         #desired image types (composites)
@@ -85,8 +265,10 @@ class Satellite:
         return total_channels
     
     def _get_satpy_kwargs(self):
+        from satpy.resample import get_area_def
+        from pyresample import create_area_def
+
         if (self.satellite == 'himawari'):
-            config.set({"array.chunk-size": "1000kiB"})
             mode = 'native'
             reader = 'ahi_hsd'
             resample_area = create_area_def("himawari_area_def", area_extent=(-5500000.0355, -5500000.0355, 5500000.0355, 5500000.0355), projection='+proj=geos +h=35785831.0 +lon_0=140.7 +sweep=y', height=2750, width=2750)
@@ -116,9 +298,9 @@ class Satellite:
         kwargs = {'mode': mode, 'reader': reader, 'resample_area': resample_area}
         return kwargs    
        
+    @timed('_generate_image_from_data', bytes_of=lambda args, result: file_bytes(*args[0]._get_data_files()))
     def _generate_image_from_data(self):
-        config.set({"array.chunk-size": "1024kiB"})
-        config.set(num_workers=2)
+        from satpy import Scene
 
         if (self.get_projections):
             output_file_name = self.website_dir_pre + f'images/projected/{self.satellite}_projected'
@@ -126,57 +308,154 @@ class Satellite:
             output_file_name = self.website_dir_pre + f'images/fd/latest_{self.satellite}_FD'
 
         kwargs = self._get_satpy_kwargs()
-        existing_data_files = glob(self.data_file_path + '*')
+        existing_data_files = self._get_reader_files()
         scn = Scene(filenames=existing_data_files, reader=kwargs['reader'])
-
-        for composite in self.composites:
-            scn.load([composite], generate=False)
+        #a single load of every composite, so bands shared between composites are only read once
+        composites = self._target_composites()
+        scn.load(composites, generate=False)
+
+        #targets on other areas are resampled from the full disk, the native resample fails on a cropped scene
+        full_scn = scn
+
+        #himawari only downloads the segments in the region of interest, missing ones are padded by satpy.
+        #The other readers crop the lines they read, which is only possible when projecting directly,
+        #since the native resample still targets the full disk area
+        if (self.get_projections == True and self.region_of_interest == True and self.direct_projection == True
+                and kwargs['reader'] != 'ahi_hsd'):
+            scn = self._crop_to_roi(scn, kwargs['resample_area'])
         
-        if (kwargs['resample_area'] == 'none'):
-            kwargs['resample_area'] = scn.coarsest_area()
+        if (self.get_projections == True and self.direct_projection == True):
+            #project the loaded channels straight to the output grid and let satpy build the
+            #composites there, so no intermediate full disk image is ever created
+            resampled_scn = self._project(scn)
+            native_scn = None
+        else:
+            if (kwargs['resample_area'] == 'none'):
+                kwargs['resample_area'] = scn.coarsest_area()
+
+            resampled_scn = native_scn = scn.resample(kwargs['resample_area'], resampler=kwargs['mode'], reduce_data=False)
+
+            if (self.get_projections == True):
+                resampled_scn = self._project(native_scn, composites)
+
+        if (self.targets):
+            self._render_targets(full_scn, native_scn, resampled_scn if self.get_projections == True else None)
+
+        if (self.in_memory == True):
+            return resampled_scn
 
-        resampled_scn = scn.resample(kwargs['resample_area'], resampler=kwargs['mode'], reduce_data=False)
+        #the composites are enhanced like save_dataset does and encoded in parallel. Projected images
+        #are only read back by the next step, so they use the fast intermediate preset
+        outputs = {}
 
-        if (self.get_projections == True):
-            #resample to projection
-            kwargs['resample_area'] = get_area_def('worldeqc3km73')
-            resampled_scn = resampled_scn.resample(kwargs['resample_area'], resampler='nearest', reduce_data=False)
+        for composite in self.composites:
+            outputs[output_file_name + ('_ir.png' if composite == 'night_ir_alpha' else '.png')] = composite
 
         try:
-            for composite in self.composites:
-                print(composite)
-                if (composite == 'night_ir_alpha'):
-                    resampled_scn.save_dataset(dataset_id=composite, filename=output_file_name + '_ir.png')
-                else:
-                    resampled_scn.save_dataset(dataset_id=composite, filename=output_file_name + '.png')
+            with Encoder(self.num_workers) as encoder:
+                for filename, composite in outputs.items():
+                    print(composite)
+                    encoder.submit(self._rgba(resampled_scn, composite), filename,
+                                   INTERMEDIATE_PRESET if self.get_projections else 'png', self.satellite)
         except:
             raise ValueError(f'Failed to save {self.satellite} images.')
         
         return resampled_scn
         
+    @timed('_combine_images', bytes_of=lambda args, result: file_bytes(args[2]))
     def _combine_images(image1, image2, filename):
-        background = Image.open(image1)
-        foreground = Image.open(image2)
-        Image.alpha_composite(background, foreground).save(filename)
+        background = Image.open(image1).convert('RGBA')
+        foreground = Image.open(image2).convert('RGBA')
+        encode(np.asarray(Image.alpha_composite(background, foreground)), filename)
+
+    def _roi_mask_args(self):
+        from satpy.resample import get_area_def
+
+        area = get_area_def(self.roi_area) if isinstance(self.roi_area, str) else self.roi_area
+        mask = load_alpha_mask(self.satellite, area, self.roi_lim, self.roi_max_angle,
+                               mask_dir=self.website_dir_pre + 'images/projected/blended_overlays/')
+        return area, mask, self.local_dir_pre + 'data/resample_cache/'
+
+    def _crop_to_roi(self, scn, area):
+        #crop the lines of the full disk that are never visible in the mosaic. The crop is lazy,
+        #so the readers only read the remaining lines, and the rest ends up transparent
+        from roi import contributing_rows, row_bbox
+
+        if (area == 'none'):
+            area = scn.coarsest_area()
+
+        rows = contributing_rows(area, *self._roi_mask_args())
+
+        if (rows is None or rows == (0, area.shape[0])):
+            return scn
+
+        return scn.crop(xy_bbox=row_bbox(area, *rows))
+
+    def _get_data_files(self):
+        #temporary files of downloads in progress are never read
+        return [file for file in glob(self.data_file_path + '*') if not file.endswith(PART_SUFFIX)]
+
+    def _get_reader_files(self):
+        #files handed to the satpy reader
+        return self._get_data_files()
+
+    def input_fingerprint(self):
+        #names, sizes and modification times of the files that would be processed, which
+        #change whenever new data is downloaded
+        digest = hashlib.sha1()
+
+        for file in sorted(self._get_data_files()):
+            stat = os.stat(file)
+            digest.update(f'{Path(file).name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
 
+        return digest.hexdigest()
+
+    def _project(self, scn, datasets=None, area='worldeqc3km73'):
+        from satpy.resample import get_area_def
+        from resample_cache import resample_scene
+
+        #resample to projection
+        area = get_area_def(area)
+
+        if (self.use_resample_cache == True):
+            #the native and projected grids never change, so the nearest neighbour
+            #lookup is cached on disk and applied as a plain gather
+            return resample_scene(scn, area, datasets, cache_dir=self.local_dir_pre + 'data/resample_cache/')
+
+        return scn.resample(area, datasets=datasets, resampler='nearest', reduce_data=False)
+
+    def _combine_arrays(background, foreground):
+        combined = Image.alpha_composite(Image.fromarray(background, 'RGBA'), Image.fromarray(foreground, 'RGBA'))
+        return np.array(combined)
+
+    def _to_rgba_array(dataset):
+        #enhance the dataset exactly like save_dataset would and return it as a (y, x, 4) uint8 array
+        from satpy.writers import get_enhanced_image
+
+        image = get_enhanced_image(dataset).pil_image()
+        return np.array(image.convert('RGBA'))
+
+    @timed('_apply_blending_masks', bytes_of=lambda args, result: file_bytes(f'{args[0].website_dir_pre}images/projected/{args[0].satellite}_projected.png'))
     def _apply_blending_masks(self):
         website_dir_pre = self.website_dir_pre
         satellite = self.satellite
         jpg = cv2.imread(website_dir_pre + f'images/projected/{satellite}_projected.jpg')
         # First create the image with alpha channel
-        rgba = cv2.cvtColor(jpg, cv2.COLOR_RGB2RGBA)
-        alpha_vals = np.loadtxt(website_dir_pre + f'images/projected/blended_overlays/{satellite}_alpha_mask.txt')
+        rgba = cv2.cvtColor(jpg, cv2.COLOR_BGR2RGBA)
+        #the uint8 mask is memory mapped and copied straight into the alpha channel
+        alpha_vals = load_alpha_mask(satellite, mask_dir=website_dir_pre + 'images/projected/blended_overlays/')
         # Then assign the mask to the last channel of the image
         rgba[:, :, 3] = alpha_vals
-        cv2.imwrite(website_dir_pre + f'images/projected/{satellite}_projected.png', rgba)
+        encode(rgba, website_dir_pre + f'images/projected/{satellite}_projected.png', satellite=satellite)
 
+    @timed('_to_jpg', bytes_of=lambda args, result: file_bytes(args[1] + '.jpg'))
     def _to_jpg(self, file):
         website_dir_pre = self.website_dir_pre
         #combine with black background
         Satellite._combine_images(website_dir_pre + 'images/projected/blended_overlays/background.png', file + '.png', file + '.png')
-        image = cv2.imread(file + '.png')
+        image = Image.open(file + '.png').convert('RGB')
         # convert to jpg
-        cv2.imwrite(file + '.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
+        encode(np.asarray(image), file + '.jpg', 'jpg_full', self.satellite)
 
     def _remove_files(files):
         for file in files:
@@ -184,86 +463,112 @@ class Satellite:
             rem_file.unlink()
 
 class Himawari(Satellite):
-    def __init__(self, satellite, composites, get_projections=False) -> None:
-        super().__init__(satellite, composites, get_projections)
+    def __init__(self, satellite, composites, get_projections=False, in_memory=False) -> None:
+        super().__init__(satellite, composites, get_projections, in_memory)
         self.bucket = 'noaa-himawari9'
         self.aws_prefix = 'AHI-L1b-FLDK'
-        self.client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        self.client = get_s3_client()
+        self.downloader = S3Downloader(self.client, self.bucket)
+        self.listing = S3ListingIndex(self.client, self.bucket)
+        self.store = SegmentStore(self.data_file_path)
         self.get_projections = get_projections
+        #read decompressed copies of the bz2 segments, kept until the next scan arrives
+        self.decode_cache = True
 
+    @timed('download_data', bytes_of=downloaded_bytes)
     def download_data(self):
-        now = datetime.now(timezone.utc)
-        #get the amount of time elapsed since the most recent minute multiple of 10
-        floored_timestamp = now - timedelta(minutes=(now.minute - floor(now.minute / 10.) * 10.))        
-        folder = self._get_latest_bucket_folder(floored_timestamp)
-        existing_data_files = glob(self.data_file_path + '*')
+        folder = self._get_latest_bucket_folder(latest_ten_minutes())
         aws_filepath = self.aws_prefix + folder
-        files = []
+        entries = []
 
         for channel in self.channels:
-            file_list = self._get_latest_channel_files(aws_filepath, channel)
+            entries += self.listing.channel_files(aws_filepath, channel)
 
-            for file in file_list:
-                files.append(file.split('/')[-1])
-                
-        #remove existing raw data and download the new data
-        #himawari is zipped, so the last four characters must be removed
-        local_ch_filenames = [self.data_file_path + i for i in files]
-        delete_files = True
-        #if channel filenames are not in the existing data files already, download them
-        if (not existing_data_files or not set(local_ch_filenames).issubset(existing_data_files)):
-            try:
-                for filename in files:
-                    self._aws_data_download(aws_filepath + filename, self.data_file_path + filename)
-            except:
-                #we do not want this to continue attempting to download
-                delete_files = False
-                
-        else:
+        if (self.get_projections == True and self.region_of_interest == True):
+            segments = self._get_roi_segments()
+            entries = [entry for entry in entries if entry.get('segment') in segments]
+
+        #only segments that are missing or changed are fetched. A partial cycle is resumed on the
+        #next run, and the previous complete cycle is kept for processing until this one is complete
+        self.store.start_cycle(folder, [entry['key'].split('/')[-1] for entry in entries])
+        missing = self.store.missing(entries)
+
+        if (not missing and self.store.complete_cycle() == folder):
             print(f'{self.satellite} files already exist.')
-            delete_files = False
+            return []
 
-        if (delete_files):
-            Satellite._remove_files(existing_data_files)
+        etags = {entry['key']: entry.get('etag') for entry in entries}
+
+        try:
+            self.downloader.download_many([(entry['key'], self.data_file_path + entry['key'].split('/')[-1]) for entry in missing])
+        except Exception as error:
+            print(f'Failed to download {self.satellite} segments: {error}')
+        finally:
+            for stats in self.downloader.stats:
+                self.store.record(Path(stats['path']).name, stats['bytes'], etags[stats['key']])
+
+            self.store.save()
+
+        if (not self.store.missing(entries)):
+            self.store.commit_cycle()
         else:
-            updated_file_list = glob(self.data_file_path + '*')
-            rem_files = [i for i in updated_file_list if i not in existing_data_files]
-            Satellite._remove_files(rem_files)
-        
+            print(f'{self.satellite} cycle {folder} is incomplete, keeping the previous one.')
+
+        return self.downloader.stats
+
+    def latest_available(self):
+        #the newest complete folder, found through the cached listing
+        return self._get_latest_bucket_folder(latest_ten_minutes())
+
+    def has_latest(self, latest):
+        #whether every segment of the polled folder is downloaded, a partial cycle is resumed on the next poll
+        return self.store.complete_cycle() == latest
+
+    def _get_roi_segments(self):
+        #segments of the full disk that contain any pixel visible through the alpha mask
+        from roi import contributing_segments
+
+        target_area, mask, cache_dir = self._roi_mask_args()
+        return contributing_segments(self.kwargs['resample_area'], target_area, mask, cache_dir=cache_dir)
+
+    def _get_data_files(self):
+        #only the files of the last complete cycle are processed
+        files = self.store.complete_files()
+        return files if files else super()._get_data_files()
+
+    def _get_reader_files(self):
+        files = self._get_data_files()
+
+        if (self.decode_cache == True):
+            files = decode_segments(files, self.local_dir_pre + 'data/decoded/', self.num_workers)
+
+        return files
+
     def _get_latest_bucket_folder(self, floored_timestamp):
         #Find the folder containing the most recent file, then select the folder preceding this one
         #get the timestamp of the current day/hour/minute
         latest_folder = floored_timestamp.strftime('/%Y/%m/%d/%H%M/')
         #determine if there are sufficient files for a full image in this timestamp folder
         #there are 16 channels with ten slices each, for 160 total files
-        filepath = self.aws_prefix + latest_folder
-        file_response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=filepath)
+        #if not sufficient files, get the previous folder. Give up after a day of empty folders
+        for step in range(MAX_FOLDER_STEPS):
+            filepath = self.aws_prefix + latest_folder
 
-        #if not sufficient files, get the previous folder
-        if (len(file_response.get('Contents', [])) < 160):
-            previous_timestamp = floored_timestamp - timedelta(minutes=10)
-            latest_folder = self._get_latest_bucket_folder(previous_timestamp)
-        
-        return latest_folder
-    
-    def _get_latest_channel_files(self, folder, channel):
-        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=folder)
-        channel_files = []
+            if (len(self.listing.list(filepath)) >= 160):
+                return latest_folder
 
-        for content in response.get('Contents', []):
-            if (channel in content['Key']):
-                channel_files.append(content['Key'])
+            floored_timestamp -= timedelta(minutes=10)
+            latest_folder = floored_timestamp.strftime('/%Y/%m/%d/%H%M/')
 
-        channel_files = [i.split('/')[-1] for i in channel_files]
-        return channel_files
+        raise ValueError(f'No complete {self.satellite} folder found in {self.bucket}.')
     
     def _aws_data_download(self, aws_filepath, local_path):
-        self.client.download_file(self.bucket, aws_filepath, local_path)
+        return self.downloader.download(aws_filepath, local_path)
 
 #the GOES class is used for both GOES-East and GOES-West
 class GOES(Satellite):
-    def __init__(self, satellite, composites, get_projections=False) -> None:
-        super().__init__(satellite, composites, get_projections)
+    def __init__(self, satellite, composites, get_projections=False, in_memory=False) -> None:
+        super().__init__(satellite, composites, get_projections, in_memory)
 
         if (satellite == 'goes_east'):
             self.bucket = 'noaa-goes16'
@@ -272,13 +577,13 @@ class GOES(Satellite):
             self.bucket = 'noaa-goes18'
 
         self.aws_prefix = 'ABI-L1b-RadF'
-        self.client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        self.client = get_s3_client()
+        self.downloader = S3Downloader(self.client, self.bucket)
+        self.listing = S3ListingIndex(self.client, self.bucket)
 
+    @timed('download_data', bytes_of=downloaded_bytes)
     def download_data(self):
-        now = datetime.now(timezone.utc)
-        #get the amount of time elapsed since the most recent minute multiple of 10
-        floored_timestamp = now - timedelta(minutes=(now.minute - floor(now.minute / 10.) * 10.))        
-        folder = self._get_latest_bucket_folder(floored_timestamp)
+        folder = self._get_latest_bucket_folder(latest_ten_minutes())
         existing_data_files = glob(self.data_file_path + '*')
         aws_filepath = self.aws_prefix + folder
         files = []
@@ -292,12 +597,12 @@ class GOES(Satellite):
         #remove existing raw data and download the new files
         local_ch_filenames = [self.data_file_path + i for i in files]
         delete_files = True
+        downloaded = []
 
         #if channel filenames are not in the existing data files already, download them
         if (not existing_data_files or not set(local_ch_filenames).issubset(existing_data_files)):
             try:
-                for filename in files:
-                    self._aws_data_download(aws_filepath + filename, self.data_file_path + filename)
+                downloaded = self.downloader.download_many([(aws_filepath + filename, self.data_file_path + filename) for filename in files])
             except:
                 #we do not want this to continue attempting to download
                 delete_files = False
@@ -312,70 +617,126 @@ class GOES(Satellite):
             updated_file_list = glob(self.data_file_path + '*')
             rem_files = [i for i in updated_file_list if i not in existing_data_files]
             Satellite._remove_files(rem_files)
+
+        return downloaded
+
+    def latest_available(self):
+        #the files of the most recent scan of the first channel. The hour's listing is cached
+        folder = self._get_latest_bucket_folder(latest_ten_minutes())
+        return tuple(self._get_latest_channel_files(self.aws_prefix + folder, self.channels[0]))
+
+    def has_latest(self, latest):
+        #whether the polled scan is downloaded. Files of a failed download are removed, so they are all present
+        return all(os.path.exists(self.data_file_path + name) for name in latest)
         
     def _get_latest_bucket_folder(self, floored_timestamp):
         #if it is the beginning of a new hour, the file will be in the previous hour's folder
         if (floored_timestamp.strftime('%M') == '00'):
             floored_timestamp -= timedelta(minutes=5)
 
-        latest_folder = floored_timestamp.strftime('/%Y/%j/%H/')
-        #get most recent files in this folder
-        filepath = self.aws_prefix + latest_folder
-        file_response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=filepath)
         #goes files are uploaded to the hour's folder in ten minute intervals
         #we just need to find the most recent upload. So we look for the most recent folder
-        #and if empty, recursively run the program pushing it back each time
-        if (not file_response.get('Contents', [])):
-            previous_timestamp = floored_timestamp - timedelta(minutes=10)
-            latest_folder = self._get_latest_bucket_folder(previous_timestamp)
+        #and if empty, push it back each time. Steps within the same hour reuse the cached listing
+        for step in range(MAX_FOLDER_STEPS):
+            latest_folder = floored_timestamp.strftime('/%Y/%j/%H/')
+            filepath = self.aws_prefix + latest_folder
+
+            if (self.listing.list(filepath)):
+                return latest_folder
 
-        return latest_folder
+            floored_timestamp -= timedelta(minutes=10)
+
+        raise ValueError(f'No {self.satellite} folder found in {self.bucket}.')
     
     def _get_latest_channel_files(self, aws_filepath, channel):
-        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=aws_filepath)
-        latest_files = []
-        channel_files = []
-        modified_dates = []
-
-        #loop through the hour's files and make a list of all files for the desired channel
-        #then find the most recent file in this list
-        for content in response.get('Contents', []):
-            if (channel in content['Key']):
-                channel_files.append(content['Key'])
-                modified_dates.append(content['LastModified'])
-
-        for i in range(len(channel_files)):
-            if (modified_dates[i] == max(modified_dates)):
-                latest_files = [channel_files[i].split('/')[-1]]
-
+        #the hour's listing is paginated once and shared between all channels,
+        #then the files of the most recent scan of the channel are selected
+        latest_files = self.listing.latest_channel_files(aws_filepath, channel)
+        latest_files = [entry['key'].split('/')[-1] for entry in latest_files]
         return latest_files
     
     def _aws_data_download(self, aws_filepath, local_path):
-        self.client.download_file(self.bucket, aws_filepath, local_path)
+        return self.downloader.download(aws_filepath, local_path)
 
 #the Meteosat class is used for both Meteosat-9 and Meteosat-10,
 #however, native files have all channels by default, so the channels attribute is set to 'none'
 class Meteosat(Satellite):
-    def __init__(self, satellite, composites, get_projections=False) -> None:
-        super().__init__(satellite, composites, get_projections)
-        self.token = self._eumetsat_get_token()
-
+    def __init__(self, satellite, composites, get_projections=False, in_memory=False) -> None:
+        super().__init__(satellite, composites, get_projections, in_memory)
+        #the token is only requested when data is downloaded, and shared between both satellites
+        self.token = None
+        self.data_store_url = EUMETSAT_DOWNLOAD_URL
+        self.downloader = HTTPDownloader()
+
+    @timed('download_data', bytes_of=downloaded_bytes)
     def download_data(self):
         satellite = self.satellite
-        self.existing_data_files = glob(self.data_file_path + '*')
+        self.existing_data_files = self._get_data_files()
         existing_data_files = self.existing_data_files
-        token = self.token
-        datastore = eumdac.DataStore(token)
+        collection_id = self._collection_id()
+
+        #a new product is only published every repeat cycle, so there is no need to search
+        #the data store if the product we have is younger than that
+        if (self._latest_is_current(existing_data_files)):
+            print(f'{satellite} product is less than {SEVIRI_REPEAT_CYCLE} old, skipping search.')
+            return []
 
-        if (satellite == 'meteosat_10'):
+        product = self._latest_product(collection_id)
+        native_name = f'{product}.nat'
+        downloaded = []
+        #partial downloads of older products that failed every retry would never be resumed
+        Satellite._remove_files([file for file in glob(self.data_file_path + '*' + PART_SUFFIX) if Path(file) != partial_path(self.data_file_path + native_name)])
+
+        #if the data file is not already downloaded
+        if(not any(native_name in x for x in existing_data_files)):
+            url = f'{self.data_store_url}/collections/{quote(collection_id)}/products/{quote(str(product))}/entry?name={quote(native_name)}'
+
+            #download the single product. The old one is only removed once the new one is complete
+            try:
+                downloaded = [self.downloader.download(url, self.data_file_path + native_name, headers=self._auth_headers())]
+                Satellite._remove_files(existing_data_files)
+            except requests.exceptions.HTTPError as error:
+                #an expired token is refreshed for the next cycle
+                if (error.response.status_code == 401):
+                    _tokens.clear()
+
+                print(f"Error related to the product '{product}' while trying to download it: '{error}'")
+            except (requests.exceptions.RequestException, ValueError) as error:
+                print(f"Unexpected error: {error}")
+        else:
+            print (f'File {native_name} already exists.')
+
+        return downloaded
+
+    def latest_available(self):
+        #the data store is only searched once the product we have is a repeat cycle old
+        existing_data_files = self._get_data_files()
+
+        #both are the product id, so the poll only sees a change when a new product is published
+        if (self._latest_is_current(existing_data_files)):
+            return self._local_product(existing_data_files)[0]
+
+        return str(self._latest_product(self._collection_id()))
+
+    def has_latest(self, latest):
+        #whether the polled product is downloaded
+        return self._local_product(self._get_data_files())[0] == latest
+
+    def _collection_id(self):
+        if (self.satellite == 'meteosat_10'):
             #0 degree longitude satellite
-            collection_id = 'EO:EUM:DAT:MSG:HRSEVIRI'
-        elif (satellite == 'meteosat_9'):
+            return 'EO:EUM:DAT:MSG:HRSEVIRI'
+        elif (self.satellite == 'meteosat_9'):
             #45 degree longitude "indian ocean" satellite
-            collection_id = 'EO:EUM:DAT:MSG:HRSEVIRI-IODC'
+            return 'EO:EUM:DAT:MSG:HRSEVIRI-IODC'
         else:
             raise ValueError('Invalid satellite option.')
 
+    def _latest_product(self, collection_id):
+        import eumdac
+
+        datastore = eumdac.DataStore(self._get_token())
+
         try:    
             selected_collection = datastore.get_collection(collection_id)
         except eumdac.datastore.DataStoreError as error:
@@ -385,26 +746,37 @@ class Meteosat(Satellite):
         except requests.exceptions.RequestException as error:
             print(f"Unexpected error: {error}")
 
-        product = selected_collection.search().first()
-        native_name = f'{product}.nat'
+        return selected_collection.search().first()
 
-        #if the data file is not already downloaded
-        if(not any(native_name in x for x in existing_data_files)):
-            Satellite._remove_files(existing_data_files)
-            #download the single product
-            try:
-                with product.open(entry=native_name) as fsrc, \
-                    open(f'{self.data_file_path}/{fsrc.name}', mode='wb') as fdst:
-                    shutil.copyfileobj(fsrc, fdst)
-                    print(f'Download of file {fsrc.name} finished.')
-            except eumdac.product.ProductError as error:
-                print(f"Error related to the product '{product}' while trying to download it: '{error.msg}'")
-            except requests.exceptions.RequestException as error:
-                print(f"Unexpected error: {error}")
-        else:
-            print (f'File {native_name} already exists.')
+    def _local_product(self, existing_data_files):
+        #product id and sensing end time of the downloaded product. The file is named after the product id,
+        #which ends with the sensing end time, e.g. MSG3-SEVI-MSG15-0100-NA-20231018104241.887000000Z-NA
+        for file in existing_data_files:
+            match = re.search(r'-(\d{14})\.\d+Z', Path(file).name)
+
+            if (match):
+                return Path(file).stem, datetime.strptime(match[1], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+        return None, None
+
+    def _latest_is_current(self, existing_data_files):
+        sensing_end = self._local_product(existing_data_files)[1]
+        return sensing_end is not None and datetime.now(timezone.utc) - sensing_end < SEVIRI_REPEAT_CYCLE
+
+    def _auth_headers(self):
+        #the access token refreshes itself when it is about to expire
+        return {'Authorization': f'Bearer {self._get_token().access_token}'}
+
+    def _get_token(self):
+        if ('eumetsat' not in _tokens):
+            _tokens['eumetsat'] = self._eumetsat_get_token()
+
+        self.token = _tokens['eumetsat']
+        return self.token
 
     def _eumetsat_get_token(self):
+        import eumdac
+
         key = 'your_key'
         secret = 'your_secret'
         credentials = (key, secret)
@@ -415,7 +787,3 @@ class Meteosat(Satellite):
             print(f"Error when tryng the request to the server: '{error}'")
         
         return token
-
-
-
-
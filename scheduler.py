@@ -1,17 +1,64 @@
-from datetime import datetime
-from process_images import stitch_images
+from helpers import stitch_images, stitch_incremental
+from tiles import build_tiles
+from archive import MosaicArchive
+from store import LayerStore
+from profiling import profile, set_cycle, span
 from multiprocessing import cpu_count
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import os
+import threading
 
 from satellites import GOES, Himawari, Meteosat
 
-goes_east = GOES('goes_east', ['true_color_day', 'night_ir_alpha'], True)
-goes_west = GOES('goes_west', ['true_color_day', 'night_ir_alpha'], True)
-himawari = Himawari('himawari', ['true_color_day', 'night_ir_alpha'], True)
-meteosat_9 = Meteosat('meteosat_9', ['natural_color_day', 'night_ir_alpha'], True)
-meteosat_10 = Meteosat('meteosat_10', ['natural_color_day', 'night_ir_alpha'], True)
+#rough peak memory of processing one satellite, used to size the process pool
+PROCESS_MEMORY = 4 * 1024 ** 3
+#per satellite estimates, himawari reads many more segments than the others
+MEMORY_ESTIMATES = {'himawari': 6 * 1024 ** 3}
+#fraction of the physical memory the processing workers may use together
+MEMORY_FRACTION = 0.8
+#also archive the projected layer of every satellite, not only the mosaic
+ARCHIVE_LAYERS = False
 
-satellites = [goes_east, goes_west, himawari, meteosat_9, meteosat_10]
+class ResourceBudget:
+    #memory budget shared by the pipeline threads. A satellite is only handed to a worker
+    #process once its estimated peak memory fits in what the running ones left over
+    def __init__(self, memory) -> None:
+        self.total = memory
+        self.available = memory
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        #a single satellite larger than the whole budget is still allowed to run alone
+        amount = min(amount, self.total)
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+
+        return amount
+
+    def release(self, amount):
+        with self.condition:
+            self.available += amount
+            self.condition.notify_all()
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def create_satellites(names=None):
+    #only the requested satellites are created, in mosaic order
+    constructors = {
+        'goes_east': lambda: GOES('goes_east', ['true_color_day', 'night_ir_alpha'], True, True),
+        'goes_west': lambda: GOES('goes_west', ['true_color_day', 'night_ir_alpha'], True, True),
+        'himawari': lambda: Himawari('himawari', ['true_color_day', 'night_ir_alpha'], True, True),
+        'meteosat_9': lambda: Meteosat('meteosat_9', ['natural_color_day', 'night_ir_alpha'], True, True),
+        'meteosat_10': lambda: Meteosat('meteosat_10', ['natural_color_day', 'night_ir_alpha'], True, True),
+    }
+
+    return [create() for name, create in constructors.items() if names is None or name in names]
 
 def download(satellite):
     try:
@@ -19,38 +66,142 @@ def download(satellite):
         satellite.download_data()
     except:
         raise ValueError(f'Failed to download {satellite.satellite} data.')
-    
+
 def process(satellite):
     try:
         print(f'Processing {satellite.satellite} into {satellite.composites} image.')
-        satellite.process_images()
+        return satellite.process_images()
     except:
         raise ValueError(f'Failed to process {satellite.composites} image.')
 
-def parallel_activities():
-    cpus = cpu_count()
+def process_workers(n_satellites):
+    #as many processes as there are cores, but no more than fit in memory at once
+    workers = min(cpu_count(), n_satellites)
+    memory = total_memory()
+
+    if (memory is not None):
+        workers = min(workers, int(memory * MEMORY_FRACTION) // PROCESS_MEMORY)
 
+    return max(1, workers)
+
+def start_process_pool(workers):
+    #the workers are forked here, from the calling thread, before any download thread exists. With the
+    #fork start method the pool forks all of its workers on the first submit, and doing that from a
+    #pipeline thread while other threads hold the stdout, ssl or urllib3 locks can deadlock the children
+    process_pool = ProcessPoolExecutor(workers)
+    process_pool.submit(int).result()
+    return process_pool
+
+def create_budget(workers):
+    memory = total_memory()
+    return ResourceBudget(int(memory * MEMORY_FRACTION) if memory else workers * PROCESS_MEMORY)
+
+def run_satellite(satellite, process_pool, budget, fingerprints=None):
+    #download, then wait for room in the memory budget and process in a worker process.
+    #If fingerprints of the last processed inputs are given, a satellite whose input did not
+    #change is not processed again and None is returned
     try:
-        cpus = cpu_count()
+        download(satellite)
+    except Exception as error:
+        #the data of the previous cycle is still usable
+        print(f'{error} Processing existing {satellite.satellite} data.')
 
-        pool = ThreadPool(cpus)
-        results = pool.imap_unordered(download, satellites)
+    if (fingerprints is not None):
+        fingerprint = satellite.input_fingerprint()
 
-        for result in results:
-            pass
+        if (fingerprints.get(satellite.satellite) == fingerprint):
+            print(f'{satellite.satellite} input is unchanged, skipping processing.')
+            return None
+
+    memory = budget.acquire(MEMORY_ESTIMATES.get(satellite.satellite, PROCESS_MEMORY))
+
+    try:
+        layer = process_pool.submit(process, satellite).result()
+    finally:
+        budget.release(memory)
+
+    if (fingerprints is not None):
+        fingerprints[satellite.satellite] = fingerprint
+
+    return layer
+
+def process_satellites(satellites, process_pool, budget, fingerprints=None):
+    #each satellite is processed as soon as its own download is done, so fast feeds do not
+    #wait for the slowest one. Returns the layer of every satellite that did not fail, which is
+    #None for satellites skipped because their input did not change
+    layers = {}
+
+    with ThreadPoolExecutor(len(satellites)) as pipeline_pool:
+        futures = {pipeline_pool.submit(run_satellite, satellite, process_pool, budget, fingerprints): satellite for satellite in satellites}
+
+        for future in as_completed(futures):
+            satellite = futures[future]
+
+            #a satellite that fails to process is left out of the mosaic
+            try:
+                layers[satellite.satellite] = future.result()
+            except Exception as error:
+                print(f'Failed to process {satellite.satellite}: {error}')
+
+    return layers
+
+def publish(layers, archive=None, layer_store=None, fingerprints=None):
+    #projected layers are kept in memory, only the final mosaic and its tiles are written to disk.
+    #With a layer store, layers only holds the satellites processed this cycle and the stored
+    #mosaic is updated where they are visible
+    if (layer_store is None):
+        mosaic = stitch_images(layers)
+    else:
+        mosaic = stitch_incremental(layer_store, {satellite: (layer, fingerprints[satellite]) for satellite, layer in layers.items()})
+
+    #the tiles and the archived frames are encoded at the same time
+    with ThreadPoolExecutor(2) as encode_pool:
+        tiles = encode_pool.submit(build_tiles, mosaic)
+
+        #keep a rolling history of the mosaic for animations
+        archive = archive or MosaicArchive()
+        archive.add(mosaic)
+
+        if (ARCHIVE_LAYERS):
+            for satellite, layer in layers.items():
+                archive.add(layer, layer=satellite)
+
+        tiles.result()
+
+    return mosaic
+
+def parallel_activities(satellites, incremental=True):
+    #processing runs in separate processes, since dask and satpy configuration is global to a
+    #process and the work is CPU bound. The cores are split between the processes, and their
+    #combined memory is kept within the budget. In incremental mode, satellites whose input did not
+    #change since the last run keep their stored layer and are not processed at all
+    workers = process_workers(len(satellites))
+    budget = create_budget(workers)
+    layer_store = LayerStore() if incremental else None
+    fingerprints = layer_store.fingerprints() if incremental else None
 
-    except:
-        raise ValueError('Failed to create thread pool for downloads.')
-    
     for satellite in satellites:
-        satellite.process_images()
-    
-    stitch_images()
+        satellite.num_workers = max(1, cpu_count() // workers)
+
+    with start_process_pool(workers) as process_pool:
+        layers = process_satellites(satellites, process_pool, budget, fingerprints)
+
+    layers = {satellite: layer for satellite, layer in layers.items() if layer is not None}
+
+    if (not layers):
+        print('No satellite has new data, keeping the current mosaic.')
+        return
+
+    publish(layers, layer_store=layer_store, fingerprints=fingerprints)
+
+def run_once(satellites, incremental=True):
+    cycle = set_cycle()
+
+    with span('cycle') as record, profile(f'cycle_{cycle}'):
+        parallel_activities(satellites, incremental)
 
-t1 = datetime.now()
-parallel_activities()
-t2 = datetime.now()
-delta = t2 - t1
+    print('#########################################################')
+    print('Finished! Elapsed time: ', record['seconds'] / 60.)
 
-print('#########################################################')
-print('Finished! Elapsed time: ', (delta.total_seconds()) / 60.)
\ No newline at end of file
+if __name__ == '__main__':
+    run_once(create_satellites())
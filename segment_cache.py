@@ -0,0 +1,46 @@
+from atomic import atomic_write
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from pathlib import Path
+import bz2
+import shutil
+
+#decompressed himawari segments, keyed by file name
+DECODED_DIR = 'data/decoded/'
+COPY_BUFFER = 16 * 1024 ** 2
+
+def decoded_path(file, cache_dir=DECODED_DIR):
+    name = Path(file).name
+    return Path(cache_dir) / (name[:-len('.bz2')] if name.endswith('.bz2') else name)
+
+def _decompress(file, target):
+    #segment file names contain the scan time, band and segment number, so a cached file with
+    #the same name is the same data and is never decompressed again
+    if (target.exists()):
+        return target
+
+    with bz2.open(file, 'rb') as source:
+        atomic_write(target, lambda out: shutil.copyfileobj(source, out, COPY_BUFFER))
+
+    return target
+
+def decode_segments(files, cache_dir=DECODED_DIR, workers=None):
+    #decompress the bz2 segments into the cache in parallel and return the paths to read instead.
+    #satpy then memory maps the plain segments, rather than decompressing every file into a
+    #temporary one on a single core each time the scene is created. Files of older scans are removed
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    compressed = [file for file in files if str(file).endswith('.bz2')]
+    targets = [decoded_path(file, cache_dir) for file in compressed]
+
+    #bz2 releases the GIL while decompressing, so threads are enough
+    with ThreadPoolExecutor(workers or cpu_count()) as pool:
+        decoded = list(pool.map(_decompress, compressed, targets))
+
+    keep = {target.name for target in targets}
+
+    for path in cache_dir.iterdir():
+        if (path.name not in keep):
+            path.unlink(missing_ok=True)
+
+    return [str(path) for path in decoded] + [file for file in files if not str(file).endswith('.bz2')]
@@ -0,0 +1,136 @@
+from atomic import atomic_write
+from pathlib import Path
+import json
+import numpy as np
+
+class ManifestStore:
+    #a directory with a json manifest describing its files. The manifest is written to a temporary
+    #file and renamed, so an interrupted run never leaves a broken one
+    def __init__(self, directory, manifest_name) -> None:
+        self.directory = Path(directory)
+        self.manifest_file = self.directory / manifest_name
+        self.manifest = self._load()
+
+    def _empty(self):
+        return {}
+
+    def _load(self):
+        try:
+            with open(self.manifest_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return self._empty()
+
+    def save(self):
+        atomic_write(self.manifest_file, lambda file: json.dump(self.manifest, file, indent=1), 'w')
+
+class SegmentStore(ManifestStore):
+    #local store of raw data segments with a manifest of the size and ETag of every file.
+    #Files are only fetched when missing or changed, and the last complete cycle stays the one
+    #used for processing until every file of the next cycle is present
+    def __init__(self, directory, manifest_name='.manifest.json') -> None:
+        super().__init__(directory, manifest_name)
+
+    def _empty(self):
+        return {'files': {}, 'complete': None, 'pending': None}
+
+    def is_current(self, name, size, etag=None):
+        #files that predate the manifest are accepted if their size matches
+        path = self.directory / name
+        record = self.manifest['files'].get(name)
+
+        if (not path.exists() or path.stat().st_size != size):
+            return False
+
+        return record is None or etag is None or record.get('etag') in (None, etag)
+
+    def missing(self, entries):
+        #entries are listing entries with 'key', 'size' and 'etag'
+        return [entry for entry in entries if not self.is_current(entry['key'].split('/')[-1], entry['size'], entry.get('etag'))]
+
+    def record(self, name, size, etag=None):
+        self.manifest['files'][name] = {'size': size, 'etag': etag}
+
+    def start_cycle(self, cycle, names):
+        #a partial cycle is resumed if it is the same one, otherwise its files are dropped,
+        #keeping the files of the last complete cycle
+        pending = self.manifest['pending']
+
+        if (pending is not None and pending['cycle'] != cycle):
+            self._remove(set(pending['files']) - set(self.complete_names()))
+
+        self.manifest['pending'] = {'cycle': cycle, 'files': sorted(names)}
+        self.save()
+
+    def commit_cycle(self):
+        #the pending cycle is fully present, make it the one used for processing and remove the other
+        #segments. Dotfiles (the manifest, .gitkeep) are never segments and are left alone
+        self.manifest['complete'] = self.manifest['pending']
+        self.manifest['pending'] = None
+        keep = set(self.complete_names())
+        self._remove([path.name for path in self.directory.iterdir() if path.is_file() and path.name not in keep
+                      and not path.name.startswith('.')])
+        self.manifest['files'] = {name: record for name, record in self.manifest['files'].items() if name in keep}
+        self.save()
+
+    def complete_cycle(self):
+        complete = self.manifest['complete']
+        return None if complete is None else complete['cycle']
+
+    def complete_names(self):
+        complete = self.manifest['complete']
+        return [] if complete is None else complete['files']
+
+    def complete_files(self):
+        return [str(self.directory / name) for name in self.complete_names()]
+
+    def _remove(self, names):
+        for name in names:
+            (self.directory / name).unlink(missing_ok=True)
+            self.manifest['files'].pop(name, None)
+
+#last projected layer of every satellite, used to recompose the mosaic incrementally
+LAYER_DIR = 'data/layers/'
+
+class LayerStore(ManifestStore):
+    #the last projected RGBA layer of every satellite with the fingerprint of the input it was made
+    #from, and the mosaic composed from those layers. Layers are stored as .npy files and memory
+    #mapped, so unchanged satellites cost nothing to keep in the mosaic
+    def __init__(self, directory=LAYER_DIR, manifest_name='layers.json') -> None:
+        super().__init__(directory, manifest_name)
+
+    def _empty(self):
+        return {'layers': {}, 'mosaic': None}
+
+    def _save_array(self, name, array):
+        #a memory map of the previous file stays valid after the rename
+        atomic_write(self.directory / f'{name}.npy', lambda file: np.save(file, np.ascontiguousarray(array)))
+
+    def _load_array(self, name, mmap_mode='r'):
+        path = self.directory / f'{name}.npy'
+        return np.load(path, mmap_mode=mmap_mode) if path.exists() else None
+
+    def fingerprints(self):
+        #satellite -> fingerprint of the input of its stored layer
+        return {satellite: fingerprint for satellite, fingerprint in self.manifest['layers'].items()
+                if (self.directory / f'{satellite}.npy').exists()}
+
+    def save_layer(self, satellite, layer, fingerprint):
+        self._save_array(satellite, layer)
+        self.manifest['layers'][satellite] = fingerprint
+        self.save()
+
+    def layers(self):
+        return {satellite: self._load_array(satellite) for satellite in self.fingerprints()}
+
+    def mosaic(self, names):
+        #the stored mosaic as a writable array, if it was composed from the same satellites
+        if (self.manifest['mosaic'] != sorted(names)):
+            return None
+
+        return self._load_array('mosaic', mmap_mode=None)
+
+    def save_mosaic(self, mosaic, names):
+        self._save_array('mosaic', mosaic)
+        self.manifest['mosaic'] = sorted(names)
+        self.save()
@@ -0,0 +1,35 @@
+from encoding import PRESETS
+from tiles import block_average
+from pathlib import Path
+
+class OutputTarget:
+    #an extra image rendered from the scene a satellite already loaded for its layer.
+    #area is 'native' (the full disk grid of the satellite), 'projected' (worldeqc3km73 with the
+    #blending mask, like the mosaic layers) or the name of any other area definition.
+    #factor divides the resolution of the area by block averaging, so a preview never needs
+    #another resample. composites defaults to the composites of the satellite, and path can use
+    #{satellite}, {name} and {fmt}. preset is one of encoding.PRESETS and defaults to the format
+    def __init__(self, name, area='projected', factor=1, composites=None, fmt='png', path='images/{name}/{satellite}.{fmt}', preset=None) -> None:
+        preset = preset or fmt
+
+        if (preset not in PRESETS):
+            raise ValueError(f'Unsupported output preset {preset}, use one of {", ".join(PRESETS)}.')
+
+        #the preset decides the encoding, so it has to match the extension of the file
+        if (PRESETS[preset][0] != f'.{fmt}'):
+            raise ValueError(f'Preset {preset} encodes {PRESETS[preset][0]} files, which does not match the format {fmt}.')
+
+        self.name = name
+        self.area = area
+        self.factor = int(factor)
+        self.composites = composites
+        self.fmt = fmt
+        self.path = path
+        self.preset = preset
+
+    def output_path(self, satellite):
+        return Path(self.path.format(satellite=satellite, name=self.name, fmt=self.fmt))
+
+    def render(self, image):
+        #image is the RGBA array of the target's area at full resolution
+        return block_average(image, self.factor) if self.factor > 1 else image
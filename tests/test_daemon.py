@@ -0,0 +1,59 @@
+from archive import MosaicArchive
+from store import LayerStore
+import daemon
+import numpy as np
+
+class FakeSatellite:
+    satellite = 'himawari'
+    local_dir_pre = website_dir_pre = ''
+
+    def __init__(self, folder='/2026/10/18/1120/', complete=False) -> None:
+        self.folder = folder
+        self.complete = complete
+
+    def latest_available(self):
+        return self.folder
+
+    def has_latest(self, latest):
+        return self.complete
+
+def create_daemon(tmp_path, satellite):
+    return daemon.Daemon([satellite], poll_interval=0., archive=MosaicArchive(tmp_path / 'archive'),
+                         layer_store=LayerStore(tmp_path / 'layers'))
+
+def test_incomplete_download_is_polled_again(tmp_path, monkeypatch):
+    #the download failed, so the unchanged input was skipped and there is no new layer
+    monkeypatch.setattr(daemon, 'process_satellites', lambda satellites, *args: {'himawari': None})
+    satellite = FakeSatellite()
+    service = create_daemon(tmp_path, satellite)
+
+    service.run_cycle(service.poll())
+    assert service.seen == {}
+    assert list(service.poll().values()) == [satellite.folder]
+
+    satellite.complete = True
+    service.run_cycle(service.poll())
+    assert service.seen == {'himawari': satellite.folder}
+    assert service.poll() == {}
+
+def test_failed_publish_does_not_stop_the_daemon(tmp_path, monkeypatch):
+    cycles = []
+
+    def process_satellites(satellites, process_pool, budget, fingerprints):
+        cycles.append(satellites)
+        fingerprints['himawari'] = 'new'
+        return {'himawari': np.zeros((2, 2, 4), dtype=np.uint8)}
+
+    def publish(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(daemon, 'process_satellites', process_satellites)
+    monkeypatch.setattr(daemon, 'publish', publish)
+    monkeypatch.setattr(daemon, 'warm_caches', lambda satellites: None)
+    service = create_daemon(tmp_path, FakeSatellite(complete=True))
+
+    service.run(max_cycles=2)
+
+    assert len(cycles) == 2
+    assert service.seen == {}
+    assert service.fingerprints == {}
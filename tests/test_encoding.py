@@ -0,0 +1,28 @@
+from encoding import encode
+from targets import OutputTarget
+import numpy as np
+import pytest
+
+def test_target_preset_must_match_format():
+    assert OutputTarget('preview', fmt='jpg', preset='jpg_full').preset == 'jpg_full'
+
+    with pytest.raises(ValueError):
+        OutputTarget('preview', fmt='png', preset='jpg')
+
+def test_encode_rejects_mismatched_extension(tmp_path):
+    image = np.zeros((4, 8, 4), dtype=np.uint8)
+
+    with pytest.raises(ValueError):
+        encode(image, tmp_path / 'image.png', 'jpg')
+
+    assert list(tmp_path.iterdir()) == []
+
+def test_encode_is_atomic_and_readable(tmp_path):
+    from PIL import Image
+
+    image = np.random.default_rng(0).integers(0, 255, (4, 8, 4), dtype=np.uint8)
+    record = encode(image, tmp_path / 'image.png', 'png_fast')
+
+    assert record['bytes'] == (tmp_path / 'image.png').stat().st_size
+    assert (np.asarray(Image.open(tmp_path / 'image.png')) == image).all()
+    assert [path.name for path in tmp_path.iterdir()] == ['image.png']
@@ -0,0 +1,129 @@
+from downloads import HTTPDownloader
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import pytest
+import re
+import satellites
+
+CONTENT = bytes(range(256)) * 64
+
+class StubHandler(BaseHTTPRequestHandler):
+    #serves CONTENT, honouring Range requests unless the server is told otherwise.
+    #server.responses can hold canned (status, headers, body) answers used before the normal ones
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+
+        if (self.server.responses):
+            self._send(*self.server.responses.pop(0))
+            return
+
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+
+        if (match and not self.server.ignore_range):
+            offset = int(match[1])
+
+            if (offset >= len(CONTENT)):
+                self._send(416, {}, b'')
+            else:
+                self._send(206, {'Content-Range': f'bytes {offset}-{len(CONTENT) - 1}/{len(CONTENT)}'}, CONTENT[offset:])
+        else:
+            self._send(200, {}, CONTENT)
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.responses = []
+    server.ignore_range = False
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def downloader():
+    return HTTPDownloader(chunk_size=1024, backoff=0.)
+
+def test_download(server, tmp_path):
+    stats = downloader().download(server.url + '/product', tmp_path / 'product.nat')
+
+    assert (tmp_path / 'product.nat').read_bytes() == CONTENT
+    assert stats['bytes'] == len(CONTENT) and stats['attempts'] == 1
+    assert not (tmp_path / 'product.nat.part').exists()
+
+def test_incomplete_transfer_is_resumed(server, tmp_path):
+    #the first answer announces the full size but only sends the start of the file
+    server.responses.append((206, {'Content-Range': f'bytes 0-99/{len(CONTENT)}'}, CONTENT[:100]))
+
+    stats = downloader().download(server.url + '/product', tmp_path / 'product.nat')
+
+    assert stats['attempts'] == 2
+    assert server.requests[1]['Range'] == 'bytes=100-'
+    assert (tmp_path / 'product.nat').read_bytes() == CONTENT
+
+def test_server_ignoring_range_restarts_the_file(server, tmp_path):
+    server.ignore_range = True
+    (tmp_path / 'product.nat.part').write_bytes(CONTENT[:100])
+
+    downloader().download(server.url + '/product', tmp_path / 'product.nat')
+
+    assert server.requests[0]['Range'] == 'bytes=100-'
+    assert (tmp_path / 'product.nat').read_bytes() == CONTENT
+
+def test_stale_partial_file_is_restarted_on_416(server, tmp_path):
+    (tmp_path / 'product.nat.part').write_bytes(b'x' * (len(CONTENT) + 10))
+
+    stats = downloader().download(server.url + '/product', tmp_path / 'product.nat')
+
+    assert stats['attempts'] == 2
+    assert 'Range' not in server.requests[1]
+    assert (tmp_path / 'product.nat').read_bytes() == CONTENT
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    server.responses.append((404, {}, b''))
+
+    with pytest.raises(Exception):
+        downloader().download(server.url + '/product', tmp_path / 'product.nat')
+
+    assert len(server.requests) == 1
+
+class Token:
+    access_token = 'token'
+
+@pytest.fixture
+def meteosat(server, tmp_path, monkeypatch):
+    satellite = satellites.Meteosat('meteosat_10', ['natural_color'])
+    satellite.data_file_path = f'{tmp_path}/'
+    satellite.data_store_url = server.url
+    satellite.downloader = downloader()
+    monkeypatch.setattr(satellite, '_latest_product', lambda collection_id: 'MSG3-SEVI-MSG15-0100-NA-20231018104241.887000000Z-NA')
+    monkeypatch.setitem(satellites._tokens, 'eumetsat', Token())
+    return satellite
+
+def test_meteosat_download_sends_the_token(meteosat, server, tmp_path):
+    (tmp_path / 'OLD-20231018101241.887000000Z-NA.nat.part').write_bytes(b'old')
+
+    meteosat.download_data()
+
+    assert server.requests[0]['Authorization'] == 'Bearer token'
+    assert [path.name for path in tmp_path.iterdir()] == ['MSG3-SEVI-MSG15-0100-NA-20231018104241.887000000Z-NA.nat']
+
+def test_meteosat_expired_token_is_dropped(meteosat, server, tmp_path):
+    server.responses.append((401, {}, b''))
+
+    assert meteosat.download_data() == []
+    assert 'eumetsat' not in satellites._tokens
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,33 @@
+from satellites import Himawari
+
+def roi_satellite(tmp_path):
+    satellite = Himawari('himawari', ['true_color'], get_projections=True)
+    satellite.region_of_interest = True
+    satellite.local_dir_pre = satellite.website_dir_pre = f'{tmp_path}/'
+    return satellite
+
+def test_himawari_roi_segments(tmp_path):
+    #with the mosaic mask every segment of the disk is visible
+    assert roi_satellite(tmp_path)._get_roi_segments() == list(range(1, 11))
+
+def test_himawari_roi_segments_regional_area(tmp_path):
+    from pyresample import create_area_def
+
+    satellite = roi_satellite(tmp_path)
+    satellite.roi_area = create_area_def('japan', {'proj': 'eqc'}, area_extent=(125, 25, 150, 50), units='degrees', resolution=0.05)
+    assert satellite._get_roi_segments() == [1, 2, 3]
+
+def test_unread_segments_stay_transparent(tmp_path, monkeypatch):
+    import numpy as np
+
+    satellite = roi_satellite(tmp_path)
+    image = np.full((10, 4, 4), 200, dtype=np.uint8)
+    image[:, :, 3] = 255
+    #rows of skipped segments are NaN in the scene, which the enhancement turns into alpha 0
+    image[3:, :, 3] = 0
+    monkeypatch.setattr(satellite, '_rgba', lambda scn, composite: image)
+
+    layer = satellite._compose_composites(None, ['true_color'], np.full((10, 4), 255, dtype=np.uint8))
+
+    assert (layer[:3, :, 3] == 255).all() and (layer[:3, :, :3] == 200).all()
+    assert (layer[3:, :, 3] == 0).all()
@@ -0,0 +1,71 @@
+from downloads import S3Downloader
+from moto import mock_aws
+import boto3
+import pytest
+
+BUCKET = 'noaa-test'
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+class FlakyClient:
+    #fails the first downloads after leaving a partial file behind, like an interrupted transfer
+    def __init__(self, client, failures) -> None:
+        self.client = client
+        self.failures = failures
+        self.calls = 0
+
+    def download_file(self, bucket, key, filename, Config=None):
+        self.calls += 1
+
+        if (self.calls <= self.failures):
+            with open(filename, 'wb') as file:
+                file.write(b'partial')
+
+            raise ConnectionError('connection reset')
+
+        return self.client.download_file(bucket, key, filename, Config=Config)
+
+def test_download_many(client, tmp_path):
+    keys = [f'folder/file_{index}.nc' for index in range(5)]
+
+    for index, key in enumerate(keys):
+        client.put_object(Bucket=BUCKET, Key=key, Body=bytes([index]) * (index + 1))
+
+    stats = S3Downloader(client, BUCKET, max_workers=3).download_many([(key, tmp_path / key.split('/')[-1]) for key in keys])
+
+    assert sorted(record['bytes'] for record in stats) == [1, 2, 3, 4, 5]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [f'file_{index}.nc' for index in range(5)]
+
+def test_download_retries_and_removes_partial_files(client, tmp_path):
+    client.put_object(Bucket=BUCKET, Key='file.nc', Body=b'data')
+    flaky = FlakyClient(client, failures=2)
+
+    stats = S3Downloader(flaky, BUCKET, backoff=0.).download('file.nc', tmp_path / 'file.nc')
+
+    assert stats['attempts'] == 3
+    assert (tmp_path / 'file.nc').read_bytes() == b'data'
+    assert not (tmp_path / 'file.nc.part').exists()
+
+def test_download_gives_up_after_retries(client, tmp_path):
+    client.put_object(Bucket=BUCKET, Key='file.nc', Body=b'data')
+
+    with pytest.raises(ConnectionError):
+        S3Downloader(FlakyClient(client, failures=5), BUCKET, retries=2, backoff=0.).download('file.nc', tmp_path / 'file.nc')
+
+    assert list(tmp_path.iterdir()) == []
+
+def test_missing_key_is_not_retried(client, tmp_path):
+    downloader = S3Downloader(client, BUCKET, backoff=10.)
+
+    with pytest.raises(Exception):
+        downloader.download('missing.nc', tmp_path / 'missing.nc')
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,64 @@
+from store import SegmentStore
+
+def entry(name, size, etag='a'):
+    return {'key': f'folder/{name}', 'size': size, 'etag': etag}
+
+def fetch(store, entries):
+    #stand-in for the downloader: write and record the missing segments
+    for item in store.missing(entries):
+        name = item['key'].split('/')[-1]
+        (store.directory / name).write_bytes(b'x' * item['size'])
+        store.record(name, item['size'], item['etag'])
+
+def test_partial_cycle_is_resumed(tmp_path):
+    store = SegmentStore(tmp_path)
+    entries = [entry('S01', 3), entry('S02', 4)]
+    store.start_cycle('1120', ['S01', 'S02'])
+    fetch(store, entries[:1])
+    store.save()
+
+    #a new run of the same cycle only fetches what is still missing
+    store = SegmentStore(tmp_path)
+    store.start_cycle('1120', ['S01', 'S02'])
+    assert store.missing(entries) == entries[1:]
+    assert store.complete_cycle() is None
+
+def test_changed_segment_is_fetched_again(tmp_path):
+    store = SegmentStore(tmp_path)
+    store.start_cycle('1120', ['S01'])
+    fetch(store, [entry('S01', 3)])
+
+    assert store.missing([entry('S01', 3)]) == []
+    assert store.missing([entry('S01', 3, etag='b')]) == [entry('S01', 3, etag='b')]
+    assert store.missing([entry('S01', 5)]) == [entry('S01', 5)]
+
+def test_commit_keeps_the_complete_cycle_and_dotfiles(tmp_path):
+    (tmp_path / '.gitkeep').touch()
+    store = SegmentStore(tmp_path)
+    store.start_cycle('1110', ['old'])
+    fetch(store, [entry('old', 2)])
+    store.commit_cycle()
+
+    store.start_cycle('1120', ['S01', 'S02'])
+    fetch(store, [entry('S01', 3)])
+    #the previous cycle is processed until the new one is complete
+    assert store.complete_files() == [str(tmp_path / 'old')]
+
+    fetch(store, [entry('S02', 4)])
+    store.commit_cycle()
+
+    assert store.complete_cycle() == '1120'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['.gitkeep', '.manifest.json', 'S01', 'S02']
+
+def test_abandoned_cycle_is_dropped(tmp_path):
+    store = SegmentStore(tmp_path)
+    store.start_cycle('1110', ['S01'])
+    fetch(store, [entry('S01', 2)])
+    store.commit_cycle()
+
+    store.start_cycle('1120', ['S01', 'S02'])
+    fetch(store, [entry('S02', 4)])
+    #a newer cycle replaces the partial one, the files of the complete cycle stay
+    store.start_cycle('1130', ['S01', 'S03'])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['.manifest.json', 'S01']
@@ -0,0 +1,87 @@
+from atomic import atomic_write
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from pathlib import Path
+from PIL import Image
+import hashlib
+import io
+import json
+import math
+import numpy as np
+
+TILE_DIR = 'images/tiles/'
+
+#save options per tile format
+TILE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True}),
+    'png': ('PNG', {'compress_level': 1}),
+}
+
+def block_average(image, factor):
+    #divide the resolution by factor with factor x factor block averaging, padding sizes that are
+    #not a multiple of it by repeating the last row/column
+    height, width = image.shape[:2]
+    image = np.pad(image, ((0, -height % factor), (0, -width % factor), (0, 0)), mode='edge')
+    blocks = image.reshape(image.shape[0] // factor, factor, image.shape[1] // factor, factor, image.shape[2]).astype(np.uint32)
+    return ((blocks.sum(axis=(1, 3)) + factor ** 2 // 2) // factor ** 2).astype(np.uint8)
+
+def downscale(image):
+    #halve the resolution with 2x2 block averaging
+    return block_average(image, 2)
+
+def pyramid_levels(mosaic, tile_size=256):
+    #equirectangular image pyramid: the highest zoom level is the mosaic at full resolution and every
+    #level below halves it, down to zoom 0 which fits in a single tile width
+    max_zoom = max(0, math.ceil(math.log2(max(mosaic.shape[:2]) / tile_size)))
+    levels = {max_zoom: mosaic}
+
+    for zoom in range(max_zoom - 1, -1, -1):
+        levels[zoom] = downscale(levels[zoom + 1])
+
+    return levels
+
+def _encode_tile(tile, path, fmt, digest, previous):
+    #only tiles whose content changed since the last cycle are encoded and written
+    if (previous == digest and path.exists()):
+        return path, 0
+
+    pil_format, options = TILE_FORMATS[fmt]
+    buffer = io.BytesIO()
+    Image.fromarray(tile).save(buffer, pil_format, **options)
+    atomic_write(path, lambda file: file.write(buffer.getbuffer()))
+    return path, buffer.tell()
+
+def build_tiles(mosaic, tile_dir=TILE_DIR, tile_size=256, fmt='webp', workers=None):
+    #write the {zoom}/{x}/{y} tile pyramid of the mosaic. A manifest of tile content hashes is
+    #kept next to the tiles, so later cycles only rewrite the tiles that changed
+    tile_dir = Path(tile_dir)
+    manifest_file = tile_dir / 'tiles.json'
+    mosaic = np.ascontiguousarray(mosaic[:, :, :3])
+
+    try:
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    jobs = []
+    hashes = {}
+
+    for zoom, level in pyramid_levels(mosaic, tile_size).items():
+        for y in range(0, level.shape[0], tile_size):
+            for x in range(0, level.shape[1], tile_size):
+                tile = np.ascontiguousarray(level[y:y + tile_size, x:x + tile_size])
+                name = f'{zoom}/{x // tile_size}/{y // tile_size}.{fmt}'
+                hashes[name] = hashlib.blake2b(tile.tobytes() + str(tile.shape).encode(), digest_size=16).hexdigest()
+                jobs.append((tile, tile_dir / name, fmt, hashes[name], manifest.get(name)))
+
+    #the encoders release the GIL, so threads are enough to use every core
+    with ThreadPoolExecutor(workers or cpu_count()) as pool:
+        results = list(pool.map(lambda job: _encode_tile(*job), jobs))
+
+    atomic_write(manifest_file, lambda file: json.dump(hashes, file), 'w')
+
+    written = [size for path, size in results if size]
+    print(f'Wrote {len(written)} of {len(results)} tiles ({sum(written) / 1e6:.1f} MB).')
+    return len(written), len(results)